@@ -1,3 +1,5 @@
 from django.contrib import admin
+from .models import BackupRun, Tombstone
 
-# Register your models here.
+admin.site.register(BackupRun)
+admin.site.register(Tombstone)
@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class BackupConfig(AppConfig):
     name = 'backup'
+
+    def ready(self):
+        from . import engine, tombstones
+
+        # Incremental backups carry deletes as tombstones (backup/tombstones.py)
+        for model in engine.backup_models():
+            post_delete.connect(
+                tombstones.record_tombstone, sender=model,
+                dispatch_uid=f"backup-tombstone-{model._meta.label_lower}",
+            )
@@ -0,0 +1,252 @@
+"""Streaming, incremental database backups.
+
+A backup is one gzip-compressed NDJSON file. The first line is a header::
+
+    {"backup": {"version": 1, "kind": "FULL", "since": null, "until": "...", "models": [...]}}
+
+followed by one line per row, in the ``python`` serializer's shape::
+
+    {"model": "carts.order", "pk": 7, "fields": {...}}
+
+and, in incrementals, one line per deleted row::
+
+    {"model": "carts.cartitem", "pk": 12, "deleted": true}
+
+Rows are read with ``iterator(chunk_size=BACKUP_CHUNK_SIZE)`` and written
+straight into a gzip temp file, so memory stays flat however large the
+tables get; the file is then uploaded through the storage backend.
+
+A FULL backup holds every row of MODELS. An INCREMENTAL holds the rows
+whose ``updated_at`` (``created_at`` for insert-only models) is at or
+after the previous run's ``until`` minus BACKUP_WATERMARK_OVERLAP, which
+also covers transactions that committed after the previous run read the
+table; restoring a row twice is harmless. Models with neither column are
+copied whole every time. Deletes are captured as Tombstone rows (see
+backup/tombstones.py). A full snapshot is taken when the last one is older
+than BACKUP_FULL_INTERVAL_HOURS, and only the BACKUP_KEEP_FULL most recent
+fulls (plus the incrementals after them) are kept.
+
+The dump reads from the read replica when one is configured and healthy
+(core/db_router.py). The replica lags by at most REPLICA_MAX_LAG, well
+inside BACKUP_WATERMARK_OVERLAP, so rows it hasn't replayed yet when
+``until`` is taken are picked up by the next incremental.
+
+Restoring is the latest FULL followed by every later INCREMENTAL, in name
+order.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from core import db_router
+
+from .models import BackupRun, Tombstone
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+FULL = 'FULL'
+INCREMENTAL = 'INCREMENTAL'
+SUFFIX = '.ndjson.gz'
+
+# In dependency order, so a restore can insert them front to back
+MODELS = [
+    'auth.user',
+    'carts.cart',
+    'carts.cartitem',
+    'carts.order',
+    'carts.orderitem',
+    'carts.transaction',
+    'carts.delivery',
+    'carts.stockdeductionjob',
+    'carts.stripeevent',
+]
+# carts.verifiedpurchase is derived from delivered orders; it isn't backed
+# up, and restore_backup rebuilds it instead.
+
+
+def backup_models():
+    return [apps.get_model(label) for label in MODELS]
+
+
+def watermark_field(model):
+    names = {field.name for field in model._meta.concrete_fields}
+    for name in ('updated_at', 'created_at'):
+        if name in names:
+            return name
+    return None
+
+
+def backup_name(until, kind):
+    return f"{until:%Y%m%dT%H%M%S%fZ}-{kind.lower()}{SUFFIX}"
+
+
+def parse_name(name):
+    """The kind of a backup object, or None for anything else in storage."""
+    if not name.endswith(SUFFIX):
+        return None
+    kind = name[:-len(SUFFIX)].rpartition('-')[2].upper()
+    return kind if kind in (FULL, INCREMENTAL) else None
+
+
+class _HashingWriter:
+    """File wrapper that counts and hashes what goes through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class _Encoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder cuts datetimes to milliseconds; keep them exact
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _dumps(obj):
+    return json.dumps(obj, cls=_Encoder, separators=(',', ':'))
+
+
+def _chunks(queryset, size):
+    chunk = []
+    for obj in queryset.iterator(chunk_size=size):
+        chunk.append(obj)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_backup(fileobj, kind, since, until, chunk_size=None, using=DEFAULT_DB_ALIAS):
+    """Write one backup to a binary file object and return the row count."""
+    chunk_size = chunk_size or settings.BACKUP_CHUNK_SIZE
+    rows = 0
+    with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=settings.BACKUP_COMPRESSLEVEL, mtime=0) as out:
+        header = {'version': VERSION, 'kind': kind, 'since': since, 'until': until, 'models': MODELS}
+        out.write(_dumps({'backup': header}).encode() + b'\n')
+        for model in backup_models():
+            queryset = model._default_manager.using(using).order_by('pk')
+            field = watermark_field(model)
+            if kind == INCREMENTAL and field:
+                queryset = queryset.filter(**{f'{field}__gte': since})
+            m2m = [f.name for f in model._meta.many_to_many]
+            if m2m:
+                queryset = queryset.prefetch_related(*m2m)
+            for chunk in _chunks(queryset, chunk_size):
+                records = serializers.serialize('python', chunk, use_natural_foreign_keys=True)
+                out.write(b''.join(_dumps(record).encode() + b'\n' for record in records))
+                rows += len(records)
+        if kind == INCREMENTAL:
+            tombstones = (
+                Tombstone.objects.using(using).filter(deleted_at__gte=since, model__in=MODELS)
+                .order_by('id').values_list('model', 'object_pk')
+            )
+            for label, pk in tombstones.iterator(chunk_size=chunk_size):
+                model = apps.get_model(label)
+                out.write(_dumps({'model': label, 'pk': model._meta.pk.to_python(pk), 'deleted': True}).encode() + b'\n')
+                rows += 1
+    return rows
+
+
+def _snapshot(using):
+    # One consistent view of every table for the whole dump. SQLite reads
+    # inside a transaction already see a single snapshot (and, with the
+    # IMMEDIATE transaction mode from settings, hold the write lock; SQLite
+    # is for development); SET TRANSACTION has to be the first statement of
+    # the outermost one.
+    connection = connections[using]
+    if connection.vendor == 'postgresql' and len(connection.atomic_blocks) == 1:
+        with connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+
+def plan(now=None):
+    """(kind, since) for a backup taken now."""
+    now = now or timezone.now()
+    successful = BackupRun.objects.filter(status='SUCCEEDED')
+    last_full = successful.filter(kind=FULL).order_by('-until').first()
+    if last_full is None or last_full.until <= now - timedelta(hours=settings.BACKUP_FULL_INTERVAL_HOURS):
+        return FULL, None
+    last = successful.order_by('-until').first()
+    return INCREMENTAL, last.until - timedelta(seconds=settings.BACKUP_WATERMARK_OVERLAP)
+
+
+def execute(run, storage=None):
+    """Take the backup for a claimed (RUNNING) job and upload it.
+
+    The job's kind, or whichever is due when blank, decides FULL or
+    INCREMENTAL. Jobs are queued and claimed through backup/jobs.py.
+    """
+    try:
+        storage = storage or get_storage()
+        until = timezone.now()
+        planned_kind, since = plan(until)
+        kind = run.kind or planned_kind
+        if kind == INCREMENTAL and since is None:
+            kind = FULL
+        if kind == FULL:
+            since = None
+        run.kind, run.since, run.until, run.name = kind, since, until, backup_name(until, kind)
+        run.save(update_fields=['kind', 'since', 'until', 'name'])
+        with tempfile.TemporaryFile() as tmp:
+            writer = _HashingWriter(tmp)
+            alias = db_router.read_alias()
+            with transaction.atomic(using=alias):
+                _snapshot(alias)
+                run.rows = write_backup(writer, kind, since, until, using=alias)
+            tmp.seek(0)
+            storage.save(run.name, tmp, writer.size)
+        run.size = writer.size
+        run.sha256 = writer.sha256.hexdigest()
+        run.status = 'SUCCEEDED'
+    except Exception as e:
+        logger.exception("backup %s failed", run.name or run.id)
+        run.status = 'FAILED'
+        run.error = str(e)
+        raise
+    finally:
+        run.finished_at = timezone.now()
+        run.save()
+    if kind == FULL:
+        prune(storage)
+    logger.info("backup %s: %d rows, %d bytes", run.name, run.rows, run.size)
+    return run
+
+
+def prune(storage):
+    """Drop backups and tombstones that no kept full snapshot needs."""
+    fulls = list(
+        BackupRun.objects.filter(status='SUCCEEDED', kind=FULL).order_by('-until')[:settings.BACKUP_KEEP_FULL]
+    )
+    if not fulls:
+        return
+    # Incrementals only read tombstones from after the latest full
+    overlap = timedelta(seconds=settings.BACKUP_WATERMARK_OVERLAP)
+    Tombstone.objects.filter(deleted_at__lt=fulls[0].until - overlap).delete()
+    if len(fulls) == settings.BACKUP_KEEP_FULL:
+        for name in storage.list():
+            if parse_name(name) and name < fulls[-1].name:
+                storage.delete(name)
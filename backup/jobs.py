@@ -0,0 +1,168 @@
+"""Backup jobs: queueing, the single-run lock and the off-peak schedule.
+
+trigger_backup only queues a PENDING BackupRun and returns its id; the
+``backup_scheduler`` command, a separate process, claims queued jobs and
+runs them, and queues one itself once a day inside the off-peak window
+(BACKUP_WINDOW_START_HOUR, for BACKUP_WINDOW_HOURS, in TIME_ZONE).
+
+Claiming sets a job RUNNING, and the partial unique index
+``single_running_backup`` allows only one RUNNING row, so at most one
+backup runs at a time across every process and host; likewise
+``single_pending_backup`` keeps concurrent triggers to one queued job.
+
+A running job holds a lease: a heartbeat thread renews ``heartbeat_at``
+every BACKUP_HEARTBEAT_INTERVAL seconds, on its own connection so the
+renewals commit while the dump's transaction is still open. A RUNNING job
+whose lease is older than BACKUP_LEASE_SECONDS is taken to have died with
+its process and is failed, which releases the lock; a long backup that is
+still alive keeps its lease however long it runs.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.utils import timezone
+
+from . import engine
+from .models import BackupRun
+
+logger = logging.getLogger(__name__)
+
+
+class BackupInProgress(Exception):
+    """Another backup is RUNNING; only one may run at a time."""
+
+
+def enqueue(kind=''):
+    """Queue a backup job, or return the one already queued or running.
+
+    Returns ``(run, created)``.
+    """
+    existing = _queued_or_running()
+    if existing is not None:
+        return existing, False
+    try:
+        with transaction.atomic():
+            return BackupRun.objects.create(kind=kind or ''), True
+    except IntegrityError:
+        # A concurrent trigger queued one first (single_pending_backup)
+        existing = _queued_or_running()
+        if existing is None:
+            raise
+        return existing, False
+
+
+def _queued_or_running():
+    return BackupRun.objects.filter(status__in=['PENDING', 'RUNNING']).order_by('id').first()
+
+
+def fail_stale(now=None):
+    """Fail RUNNING jobs whose lease has lapsed."""
+    now = now or timezone.now()
+    return BackupRun.objects.filter(
+        status='RUNNING', heartbeat_at__lt=now - timedelta(seconds=settings.BACKUP_LEASE_SECONDS)
+    ).update(status='FAILED', error='lease expired', finished_at=now)
+
+
+def claim(run):
+    """Set a PENDING job RUNNING. False if someone else claimed it first."""
+    fail_stale()
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            claimed = BackupRun.objects.filter(pk=run.pk, status='PENDING').update(
+                status='RUNNING', started_at=now, heartbeat_at=now
+            )
+    except IntegrityError:
+        raise BackupInProgress("another backup is running")
+    if claimed:
+        run.status = 'RUNNING'
+        run.started_at = run.heartbeat_at = now
+    return bool(claimed)
+
+
+def renew_lease(run):
+    """Extend a RUNNING job's lease. False once it has been failed as stale."""
+    try:
+        renewed = BackupRun.objects.filter(pk=run.pk, status='RUNNING').update(heartbeat_at=timezone.now())
+    except DatabaseError as e:
+        logger.warning("backup %s: heartbeat failed: %s", run.id, e)
+        return True
+    if not renewed:
+        logger.warning("backup %s: lease lost", run.id)
+    return bool(renewed)
+
+
+@contextmanager
+def heartbeat(run):
+    """Renew ``run``'s lease from a background thread while the block runs."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.BACKUP_HEARTBEAT_INTERVAL):
+                if not renew_lease(run):
+                    return
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f"backup-{run.id}-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_pending(storage=None):
+    """Run queued jobs, oldest first, and return them once finished."""
+    finished = []
+    while True:
+        run = BackupRun.objects.filter(status='PENDING').order_by('id').first()
+        if run is None:
+            return finished
+        if not claim(run):
+            continue
+        try:
+            with heartbeat(run):
+                engine.execute(run, storage)
+        except Exception:
+            # Logged and recorded on the run by execute()
+            pass
+        finished.append(run)
+
+
+def run_backup(kind=None, storage=None):
+    """Take a backup right now in this process (tests, shell, benchmarks)."""
+    fail_stale()
+    now = timezone.now()
+    try:
+        # Created RUNNING, so it neither waits behind nor blocks the queue
+        with transaction.atomic():
+            run = BackupRun.objects.create(kind=kind or '', status='RUNNING', started_at=now, heartbeat_at=now)
+    except IntegrityError:
+        raise BackupInProgress("another backup is running")
+    with heartbeat(run):
+        return engine.execute(run, storage)
+
+
+def window_start(now=None):
+    """Start of the off-peak window that ``now`` falls in, or None outside it."""
+    local = timezone.localtime(now)
+    start = local.replace(hour=settings.BACKUP_WINDOW_START_HOUR, minute=0, second=0, microsecond=0)
+    if start > local:
+        start -= timedelta(days=1)
+    if local < start + timedelta(hours=settings.BACKUP_WINDOW_HOURS):
+        return start
+    return None
+
+
+def due(now=None):
+    """Whether the scheduler should queue a backup now: inside the off-peak
+    window, with none queued since it opened."""
+    start = window_start(now)
+    return start is not None and not BackupRun.objects.filter(created_at__gte=start).exists()
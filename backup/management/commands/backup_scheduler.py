@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backup import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued backup jobs, and queue one a day in the off-peak window (BACKUP_WINDOW_START_HOUR)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Queue a backup if one is due, run the queue and exit.")
+        parser.add_argument('--poll-interval', type=float, default=settings.BACKUP_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        while True:
+            if jobs.due():
+                run, created = jobs.enqueue()
+                if created:
+                    self.stdout.write(f"job {run.id}: scheduled backup queued")
+            try:
+                for run in jobs.run_pending():
+                    if run.status == 'SUCCEEDED':
+                        self.stdout.write(f"job {run.id}: {run.kind} backup {run.name}, {run.rows} rows, {run.size} bytes")
+                    else:
+                        self.stderr.write(f"job {run.id}: backup failed: {run.error}")
+            except jobs.BackupInProgress as e:
+                self.stderr.write(f"waiting: {e}")
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,94 @@
+from functools import partial
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from backup import engine, restore
+from backup.storage import StorageError, get_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore the latest backup: the last full snapshot in backup storage plus the incrementals after it, "
+        "falling back to the legacy db_backup.json on GitHub. --file restores local files instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', dest='files', action='append', default=[],
+                            help="A backup file (.ndjson.gz, or a dumpdata .json); repeat for a chain, in order.")
+        parser.add_argument('--legacy', action='store_true',
+                            help="Restore the legacy db_backup.json from the GitHub backups branch.")
+        parser.add_argument('--if-empty', action='store_true', help="Do nothing if the database already has data.")
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        empty = restore.is_empty()
+        if options['if_empty'] and not empty:
+            self.stdout.write("DB already has data. Skipping restore.")
+            return
+
+        restorer = restore.Restorer(batch_size=options['batch_size'], progress=self.progress)
+        try:
+            sources = self.sources(options, upsert=not empty)
+            if sources is None:
+                return
+            restorer.restore(sources)
+        except (ValueError, OSError, StorageError, requests.RequestException) as e:
+            raise CommandError(f"Restore failed, nothing was written: {e}")
+
+        for label, count in sorted(restorer.inserted.items()):
+            self.stdout.write(f"  {label}: {count} rows")
+        for label, count in sorted(restorer.deleted.items()):
+            self.stdout.write(f"  {label}: {count} deleted")
+        for label, count in sorted(restorer.derived.items()):
+            self.stdout.write(f"  {label}: {count} rows rebuilt")
+        for label, count in sorted(restorer.skipped.items()):
+            self.stdout.write(f"  {label}: {count} rows skipped (model not installed)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {restorer.rows} rows at {restorer.rate():.0f} rows/s."
+        ))
+
+    def progress(self, message, verbosity):
+        if self.verbosity >= verbosity:
+            self.stdout.write(message)
+
+    def sources(self, options, upsert):
+        """The (name, records, upsert) sources to restore, or None when there is nothing to do."""
+        if options['files']:
+            return [self.file_source(path, upsert) for path in options['files']]
+        if options['legacy']:
+            return self.legacy_source(upsert)
+
+        try:
+            storage = get_storage()
+        except ImproperlyConfigured as e:
+            self.stdout.write(f"Backup storage not configured ({e}). Cannot restore.")
+            return None
+        names = restore.backup_chain(storage)
+        if not names:
+            self.stdout.write("No backup found in backup storage, trying the legacy backup.")
+            return self.legacy_source(upsert)
+        self.stdout.write(f"Restoring {names[0]} and {len(names) - 1} incremental backup(s)...")
+        return [
+            (name, restore.read_backup(partial(storage.open, name)),
+             upsert or engine.parse_name(name) == engine.INCREMENTAL)
+            for name in names
+        ]
+
+    def file_source(self, path, upsert):
+        if path.endswith('.json'):
+            return path, restore.read_legacy(partial(open, path, 'rb')), upsert
+        return path, restore.read_backup(partial(open, path, 'rb')), upsert or engine.parse_name(path) == engine.INCREMENTAL
+
+    def legacy_source(self, upsert):
+        if not settings.GITHUB_REPO or not settings.GITHUB_TOKEN:
+            self.stdout.write("GitHub credentials not set. Cannot restore the legacy backup.")
+            return None
+        stream = restore.open_legacy_github()
+        if stream is None:
+            self.stdout.write("No legacy backup found on the GitHub backups branch.")
+            return None
+        return [(restore.LEGACY_PATH, restore.read_legacy(lambda: stream), upsert)]
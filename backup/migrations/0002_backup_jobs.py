@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='backuprun',
+            old_name='started_at',
+            new_name='created_at',
+        ),
+        migrations.AddField(
+            model_name='backuprun',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='backuprun',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='backuprun',
+            name='kind',
+            field=models.CharField(blank=True, choices=[('FULL', 'Full'), ('INCREMENTAL', 'Incremental')], default='', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='backuprun',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='backuprun',
+            name='until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='backuprun',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'RUNNING')), fields=('status',), name='single_running_backup'),
+        ),
+        migrations.AddConstraint(
+            model_name='backuprun',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'PENDING')), fields=('status',), name='single_pending_backup'),
+        ),
+    ]
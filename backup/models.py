@@ -1,3 +1,95 @@
 from django.db import models
 
-# Create your models here.
+
+class BackupRun(models.Model):
+    """One backup job, run by the engine (backup/engine.py).
+
+    Jobs are queued PENDING by trigger_backup or the scheduler and run by
+    ``manage.py backup_scheduler``; a blank ``kind`` means whichever kind
+    is due. ``until`` of the last successful run is the watermark the next
+    incremental starts from; ``name`` is the object in backup storage.
+    """
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(
+        max_length=20,
+        blank=True,
+        default='',
+        choices=[
+            ('FULL', 'Full'),
+            ('INCREMENTAL', 'Incremental'),
+        ],
+    )
+    status = models.CharField(
+        max_length=20,
+        default='PENDING',
+        choices=[
+            ('PENDING', 'Pending'),
+            ('RUNNING', 'Running'),
+            ('SUCCEEDED', 'Succeeded'),
+            ('FAILED', 'Failed'),
+        ],
+    )
+    since = models.DateTimeField(null=True, blank=True)
+    until = models.DateTimeField(null=True, blank=True)
+    name = models.CharField(max_length=255, blank=True, default='')
+    rows = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Renewed while RUNNING; a job whose lease lapses is taken to be dead
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # The single-run lock: claiming a job while another is RUNNING
+            # fails on this index, on every database.
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(status='RUNNING'),
+                name='single_running_backup',
+            ),
+            # At most one queued job, so concurrent triggers share it
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(status='PENDING'),
+                name='single_pending_backup',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'kind', '-until'], name='backuprun_status_kind_until'),
+        ]
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'since': self.since,
+            'until': self.until,
+            'name': self.name,
+            'rows': self.rows,
+            'size': self.size,
+            'sha256': self.sha256,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'heartbeat_at': self.heartbeat_at,
+            'finished_at': self.finished_at,
+        }
+
+    def __str__(self):
+        return f"{self.kind or 'Scheduled'} backup {self.name or self.id} - {self.status}"
+
+
+class Tombstone(models.Model):
+    """A deleted row of a backed-up model, so incrementals can carry deletes."""
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=100)
+    object_pk = models.CharField(max_length=64)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.model} {self.object_pk} deleted"
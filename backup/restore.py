@@ -0,0 +1,375 @@
+"""Loading backups back into the database (``manage.py restore_backup``).
+
+Records are processed as a stream through a chain of generators: parse,
+optional legacy transform, then deserialize. They are buffered per model
+and written with bulk_create in BACKUP_RESTORE_BATCH_SIZE batches, so a
+restore issues a few queries per batch instead of one save() per row.
+All of it runs in one transaction with foreign key checks deferred to
+the end (Django creates FKs DEFERRABLE INITIALLY DEFERRED on Postgres
+and SQLite). Sequences are reset afterwards so new rows don't collide
+with restored ids.
+
+Derived tables that aren't backed up (verified purchases) are rebuilt from
+the restored rows in the same transaction.
+
+Rows are inserted as they were dumped, auto_now/auto_now_add timestamps
+included, and without model signals; the dumped cart totals are already
+consistent with the dumped items. That takes a raw insert, the path
+loaddata uses: bulk_create runs each field's pre_save, which would stamp
+auto_now fields with the current time.
+"""
+import codecs
+import gzip
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from carts.models import VerifiedPurchase
+from carts.services.purchases import purchase_filter, rebuild_verified_purchases
+
+from . import engine
+from .storage import github_request
+
+# Where trigger_backup used to commit its dumpdata output
+LEGACY_BRANCH = 'backups'
+LEGACY_PATH = 'backups/db_backup.json'
+
+# carts.order columns and statuses from before Transaction and Delivery (0004)
+LEGACY_ORDER_FIELDS = ('stripe_session_id', 'payment_date', 'delivery_date')
+LEGACY_PAID_STATUSES = ('PAID', 'SHIPPED', 'DELIVERED')
+
+
+def iter_backup(fileobj):
+    """Records of an engine backup (gzip NDJSON), after checking its header."""
+    with gzip.GzipFile(fileobj=fileobj, mode='rb') as lines:
+        header = json.loads(next(lines, b'{}')).get('backup')
+        if header is None:
+            raise ValueError("not a backup file: the header line is missing")
+        if header['version'] > engine.VERSION:
+            raise ValueError(f"backup format version {header['version']} is newer than this code")
+        for line in lines:
+            yield json.loads(line)
+
+
+def read_backup(open_stream):
+    """iter_backup over the stream ``open_stream()`` returns, closed once read."""
+    with open_stream() as stream:
+        yield from iter_backup(stream)
+
+
+def read_legacy(open_stream):
+    """Transformed records of a dumpdata file, like read_backup."""
+    with open_stream() as stream:
+        yield from legacy_transform(iter_json_array(stream))
+
+
+def iter_json_array(fileobj, chunk_size=1 << 16):
+    """Items of a JSON array (a dumpdata file), parsed one at a time."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def read():
+        chunk = fileobj.read(chunk_size)
+        return utf8.decode(chunk, final=not chunk), bool(chunk)
+
+    buf, more = read()
+    buf = buf.lstrip()
+    while more and not buf:
+        buf, more = read()
+        buf = buf.lstrip()
+    if not buf.startswith('['):
+        raise ValueError("not a JSON array")
+    pos = 1
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buf):
+            if not more:
+                raise ValueError("unterminated JSON array")
+            buf, more = read()
+            pos = 0
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The item runs past the end of the buffer
+            if not more:
+                raise
+            chunk, more = read()
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+
+def legacy_transform(records):
+    """Rewrite pre-0004 carts.order rows into Order + Transaction + Delivery.
+
+    Orders carried stripe_session_id, payment_date and delivery_date, and
+    PAID/SHIPPED/DELIVERED statuses. A paid order becomes CONFIRMED with a
+    SUCCESSFUL transaction, and a shipped or delivered one also gets its
+    Delivery. Current-schema rows pass through untouched.
+    """
+    txn_pk = 0
+    delivery_pk = 0
+    for record in records:
+        fields = record.get('fields', {})
+        if record.get('model') != 'carts.order' or not (
+            any(name in fields for name in LEGACY_ORDER_FIELDS) or fields.get('status') in LEGACY_PAID_STATUSES
+        ):
+            yield record
+            continue
+
+        order_pk = record['pk']
+        stripe_id = fields.pop('stripe_session_id', None)
+        payment_date = fields.pop('payment_date', None)
+        delivery_date = fields.pop('delivery_date', None)
+        old_status = fields.get('status', 'PENDING')
+        if old_status in LEGACY_PAID_STATUSES:
+            fields['status'] = 'CONFIRMED'
+        yield record
+
+        if stripe_id or old_status != 'PENDING':
+            txn_pk += 1
+            yield {
+                'model': 'carts.transaction',
+                'pk': txn_pk,
+                'fields': {
+                    'order': order_pk,
+                    'stripe_session_id': stripe_id or f'migrated_{order_pk}',
+                    'amount': fields.get('total_amount', 0),
+                    'currency': 'inr',
+                    'status': 'SUCCESSFUL' if old_status != 'PENDING' else 'PENDING',
+                    'created_at': payment_date or fields.get('created_at'),
+                    'updated_at': payment_date or fields.get('created_at'),
+                },
+            }
+        if old_status in ('SHIPPED', 'DELIVERED'):
+            delivery_pk += 1
+            yield {
+                'model': 'carts.delivery',
+                'pk': delivery_pk,
+                'fields': {
+                    'order': order_pk,
+                    'status': 'DELIVERED' if old_status == 'DELIVERED' else 'DISPATCHED',
+                    'dispatched_at': delivery_date or fields.get('created_at'),
+                    'delivered_at': delivery_date if old_status == 'DELIVERED' else None,
+                },
+            }
+
+
+def backup_chain(storage):
+    """Names to restore from storage: the latest FULL and the INCREMENTALs after it."""
+    names = [name for name in storage.list() if engine.parse_name(name)]
+    fulls = [i for i, name in enumerate(names) if engine.parse_name(name) == engine.FULL]
+    return names[fulls[-1]:] if fulls else []
+
+
+def open_legacy_github():
+    """The dump trigger_backup used to commit to GitHub, as a byte stream, or None."""
+    response = github_request(
+        "GET", f"/repos/{settings.GITHUB_REPO}/contents/{LEGACY_PATH}",
+        params={"ref": LEGACY_BRANCH},
+        headers={"Authorization": f"Bearer {settings.GITHUB_TOKEN}", "Accept": "application/vnd.github.raw+json"},
+        stream=True,
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return response.raw
+
+
+def is_empty(using=DEFAULT_DB_ALIAS):
+    return not any(model._base_manager.using(using).exists() for model in engine.backup_models())
+
+
+def _auto_timestamps(model):
+    return [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+
+
+@contextmanager
+def _closing(records):
+    # Generator sources hold their stream open in a with block; closing the
+    # generator releases it, even when the restore fails part way through
+    try:
+        yield records
+    finally:
+        close = getattr(records, 'close', None)
+        if close is not None:
+            close()
+
+
+class Restorer:
+    def __init__(self, batch_size=None, using=DEFAULT_DB_ALIAS, progress=None):
+        self.batch_size = batch_size or settings.BACKUP_RESTORE_BATCH_SIZE
+        self.using = using
+        self.progress = progress or (lambda message, verbosity: None)
+        self.inserted = Counter()
+        self.deleted = Counter()
+        self.skipped = Counter()
+        self.derived = Counter()
+        self.touched = set()
+        self.rows = 0
+        self.started = None
+        self._now = timezone.now()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def restore(self, sources):
+        """Load each (name, records, upsert) source in order, in one transaction.
+
+        ``upsert`` replaces rows that already exist (incrementals, or a
+        restore into a database that isn't empty); otherwise rows are
+        plainly inserted. Each source's records are closed once loaded (see
+        read_backup).
+        """
+        connection = connections[self.using]
+        self.started = time.perf_counter()
+        with transaction.atomic(using=self.using):
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            for name, records, upsert in sources:
+                before = self.rows
+                with _closing(records):
+                    self.load(records, upsert)
+                self.progress(f"{name}: {self.rows - before} rows ({self.rate():.0f} rows/s overall)", 1)
+            self.rebuild_derived()
+            connection.check_constraints(table_names=[model._meta.db_table for model in self.touched])
+            self._reset_sequences(connection)
+        transaction.on_commit(purchase_filter.reset, using=self.using)
+
+    def rebuild_derived(self):
+        # Not in backups (see engine.MODELS); rebuilt from the restored orders
+        self.derived['carts.verifiedpurchase'] = rebuild_verified_purchases(using=self.using)
+        self.touched.add(VerifiedPurchase)
+
+    def load(self, records, upsert=False):
+        buffers = defaultdict(list)
+        deletes = defaultdict(list)
+        objects = serializers.deserialize(
+            'python', self._split(records, deletes), using=self.using, ignorenonexistent=True
+        )
+        for obj in objects:
+            batch = buffers[type(obj.object)]
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self._insert(type(obj.object), batch, upsert)
+                batch.clear()
+        for model, batch in buffers.items():
+            if batch:
+                self._insert(model, batch, upsert)
+        # Tombstones come after the rows of their file
+        for label, pks in deletes.items():
+            self._delete(apps.get_model(label), pks)
+
+    def _split(self, records, deletes):
+        for record in records:
+            try:
+                apps.get_model(record['model'])
+            except LookupError:
+                self.skipped[record['model']] += 1
+                continue
+            if record.get('deleted'):
+                deletes[record['model']].append(record['pk'])
+            else:
+                yield record
+
+    def _insert(self, model, batch, upsert):
+        objs = [obj.object for obj in batch]
+        for field in _auto_timestamps(model):
+            for instance in objs:
+                # Columns added after the dump was taken
+                if getattr(instance, field.attname) is None:
+                    setattr(instance, field.attname, self._now)
+        self._bulk_insert(model, objs, upsert)
+        self._set_m2m(model, batch, upsert)
+        self.touched.add(model)
+        label = model._meta.label_lower
+        self.inserted[label] += len(objs)
+        self.rows += len(objs)
+        self.progress(f"  {label}: {self.inserted[label]} rows ({self.rate():.0f} rows/s)", 2)
+
+    def _bulk_insert(self, model, objs, upsert):
+        # bulk_create without pre_save: raw=True writes the instances' values,
+        # timestamps as dumped.
+        pk = model._meta.pk
+        fields = [field for field in model._meta.concrete_fields if not field.generated]
+        with_pk = [obj for obj in objs if obj.pk is not None]
+        conflicts = {}
+        if upsert:
+            conflicts = {
+                'on_conflict': OnConflict.UPDATE,
+                'unique_fields': [pk],
+                'update_fields': [field for field in fields if field is not pk],
+            }
+        for chunk in self._batches(fields, with_pk):
+            model._base_manager.using(self.using)._insert(chunk, fields=fields, raw=True, using=self.using, **conflicts)
+        # Rows dumped with --natural-primary (legacy auth.user) that the
+        # deserializer found no existing row for: the database assigns the
+        # pk, read back before their m2m rows are written.
+        without_pk = [obj for obj in objs if obj.pk is None]
+        fields = [field for field in fields if field is not pk]
+        if connections[self.using].features.can_return_rows_from_bulk_insert:
+            batches = self._batches(fields, without_pk)
+        else:
+            batches = [[obj] for obj in without_pk]
+        for chunk in batches:
+            returned = model._base_manager.using(self.using)._insert(
+                chunk, fields=fields, raw=True, using=self.using, returning_fields=[pk]
+            )
+            for obj, (value,) in zip(chunk, returned):
+                setattr(obj, pk.attname, value)
+
+    def _batches(self, fields, objs):
+        size = max(connections[self.using].ops.bulk_batch_size(fields, objs), 1)
+        return [objs[start:start + size] for start in range(0, len(objs), size)]
+
+    def _set_m2m(self, model, batch, upsert):
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            source = f"{field.m2m_field_name()}_id"
+            target = f"{field.m2m_reverse_field_name()}_id"
+            with_data = [obj for obj in batch if field.name in obj.m2m_data]
+            if not with_data:
+                continue
+            manager = through._base_manager.using(self.using)
+            if upsert:
+                manager.filter(**{f"{source}__in": [obj.object.pk for obj in with_data]}).delete()
+            manager.bulk_create([
+                through(**{source: obj.object.pk, target: value})
+                for obj in with_data for value in obj.m2m_data[field.name]
+            ])
+            self.touched.add(through)
+
+    def _delete(self, model, pks):
+        manager = model._base_manager.using(self.using)
+        for start in range(0, len(pks), self.batch_size):
+            # A raw DELETE: no signals, and cascades arrive as their own tombstones
+            count = manager.filter(pk__in=pks[start:start + self.batch_size])._raw_delete(self.using)
+            self.deleted[model._meta.label_lower] += count
+
+    def _reset_sequences(self, connection):
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.touched))
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
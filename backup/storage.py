@@ -0,0 +1,154 @@
+"""Where backup files go.
+
+A storage backend stores named, immutable binary objects::
+
+    save(name, fileobj, size)   upload ``size`` bytes read from ``fileobj``
+    open(name)                  a readable binary stream of the object
+    list()                      every object name, sorted
+    delete(name)
+
+settings.BACKUP_STORAGE names the class. Names sort chronologically (see
+backup/engine.py), so ``list()`` is also the order to restore in.
+"""
+import os
+import shutil
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from core import upstreams
+from core.metrics import track_upstream
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalStorage:
+    """Files in a directory: BACKUP_LOCAL_DIR, or a mounted volume."""
+
+    def __init__(self, location=None):
+        self.location = str(location or settings.BACKUP_LOCAL_DIR)
+
+    def _path(self, name):
+        return os.path.join(self.location, os.path.basename(name))
+
+    def save(self, name, fileobj, size):
+        os.makedirs(self.location, exist_ok=True)
+        partial = self._path(name) + ".partial"
+        with open(partial, "wb") as out:
+            shutil.copyfileobj(fileobj, out)
+        os.replace(partial, self._path(name))
+
+    def open(self, name):
+        try:
+            return open(self._path(name), "rb")
+        except FileNotFoundError:
+            raise StorageError(f"{name} not found in {self.location}")
+
+    def list(self):
+        if not os.path.isdir(self.location):
+            return []
+        return sorted(name for name in os.listdir(self.location) if not name.endswith(".partial"))
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+
+def github_request(method, path, **kwargs):
+    """Call the GitHub API through the "github" upstream; ``path`` may also be a full URL."""
+    github = upstreams.get("github")
+    url = path if "://" in path else github.url(path)
+    with track_upstream("github"):
+        return github.session.request(method, url, timeout=github.timeout, **kwargs)
+
+
+class GitHubReleaseStorage:
+    """Assets of one GitHub release (tag BACKUP_GITHUB_TAG) in GITHUB_REPO.
+
+    Release assets are uploaded as a raw request body of up to 2 GiB, where
+    the contents API took base64 inside JSON and capped the file size.
+    """
+
+    def __init__(self, repo=None, token=None, tag=None):
+        self.repo = repo or settings.GITHUB_REPO
+        self.token = token or settings.GITHUB_TOKEN
+        self.tag = tag or settings.BACKUP_GITHUB_TAG
+        if not self.repo or not self.token:
+            raise ImproperlyConfigured("GitHub credentials not configured")
+        self.headers = {
+            "Authorization": f"Bearer {self.token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        self._release = None
+
+    def _request(self, method, path, expect=(200,), **kwargs):
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        response = github_request(method, path, headers=headers, **kwargs)
+        if response.status_code not in expect:
+            raise StorageError(f"GitHub {method} {path} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+    def release(self):
+        if self._release is None:
+            response = self._request("GET", f"/repos/{self.repo}/releases/tags/{self.tag}", expect=(200, 404))
+            if response.status_code == 404:
+                response = self._request("POST", f"/repos/{self.repo}/releases", expect=(201,), json={
+                    "tag_name": self.tag,
+                    "name": "Database backups",
+                    "body": "Written by backup/engine.py; restore with manage.py restore_backup.",
+                    "prerelease": True,
+                })
+            self._release = response.json()
+        return self._release
+
+    def _assets(self):
+        assets = {}
+        page = 1
+        while True:
+            response = self._request(
+                "GET", f"/repos/{self.repo}/releases/{self.release()['id']}/assets",
+                params={"per_page": 100, "page": page},
+            )
+            batch = response.json()
+            assets.update((asset["name"], asset["id"]) for asset in batch)
+            if len(batch) < 100:
+                return assets
+            page += 1
+
+    def _asset_id(self, name):
+        try:
+            return self._assets()[name]
+        except KeyError:
+            raise StorageError(f"{name} not found in release {self.tag}")
+
+    def save(self, name, fileobj, size):
+        upload_url = self.release()["upload_url"].split("{", 1)[0]
+        self._request(
+            "POST", upload_url, expect=(201,), params={"name": name}, data=fileobj,
+            headers={"Content-Type": "application/gzip", "Content-Length": str(size)},
+        )
+
+    def open(self, name):
+        response = self._request(
+            "GET", f"/repos/{self.repo}/releases/assets/{self._asset_id(name)}",
+            headers={"Accept": "application/octet-stream"}, stream=True,
+        )
+        # The body is the gzip file itself, not a gzip Content-Encoding
+        response.raw.decode_content = False
+        return response.raw
+
+    def list(self):
+        return sorted(self._assets())
+
+    def delete(self, name):
+        self._request("DELETE", f"/repos/{self.repo}/releases/assets/{self._asset_id(name)}", expect=(204, 404))
+
+
+def get_storage():
+    return import_string(settings.BACKUP_STORAGE)()
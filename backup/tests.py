@@ -1,3 +1,503 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from carts.models import Cart, CartItem, Delivery, Order, OrderItem, Transaction, VerifiedPurchase
+from carts.services import purchases
+from core import upstreams
+
+from . import engine, jobs, restore
+from .models import BackupRun, Tombstone
+from .storage import GitHubReleaseStorage, LocalStorage
+
+
+def read_backup(storage, name):
+    with gzip.open(storage.open(name), 'rt') as f:
+        lines = [json.loads(line) for line in f]
+    return lines[0]['backup'], lines[1:]
+
+
+def keys(records):
+    return {(record['model'], record['pk']) for record in records}
+
+
+@override_settings(BACKUP_WATERMARK_OVERLAP=0, BACKUP_CHUNK_SIZE=2)
+class BackupEngineTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.storage = LocalStorage(tmp.name)
+        self.cart = Cart.objects.create(user_id=1)
+        self.items = [
+            CartItem.objects.create(cart=self.cart, product_id=n, variant_id=n, product_name="P",
+                                    variant_name="V", sku="SKU", price=100, quantity=1)
+            for n in range(3)
+        ]
+        self.order = Order.objects.create(user_id=1, order_number="ORD-B1", total_amount=100)
+        OrderItem.objects.create(order=self.order, product_id=1, variant_id=1, product_name="P",
+                                 variant_name="V", sku="SKU", price=100, quantity=1)
+
+    def test_full_backup_streams_every_row(self):
+        run = jobs.run_backup(storage=self.storage)
+
+        self.assertEqual((run.kind, run.status), ('FULL', 'SUCCEEDED'))
+        self.assertEqual(self.storage.list(), [run.name])
+        self.assertEqual(os.path.getsize(os.path.join(self.storage.location, run.name)), run.size)
+        header, records = read_backup(self.storage, run.name)
+        self.assertEqual(header['kind'], 'FULL')
+        self.assertEqual(run.rows, len(records))
+        self.assertTrue({('carts.cart', self.cart.pk), ('carts.order', self.order.pk)} <= keys(records))
+        self.assertEqual(sum(record['model'] == 'carts.cartitem' for record in records), 3)
+
+    def test_incremental_holds_changes_since_the_watermark(self):
+        jobs.run_backup(storage=self.storage)
+        self.order.status = 'CONFIRMED'
+        self.order.save(update_fields=['status', 'updated_at'])
+        deleted = self.items[0].pk
+        self.items[0].delete()
+
+        run = jobs.run_backup(storage=self.storage)
+
+        self.assertEqual(run.kind, 'INCREMENTAL')
+        header, records = read_backup(self.storage, run.name)
+        self.assertIsNotNone(header['since'])
+        changed = keys(r for r in records if not r.get('deleted'))
+        self.assertIn(('carts.order', self.order.pk), changed)
+        # the delete also bumped the cart total
+        self.assertIn(('carts.cart', self.cart.pk), changed)
+        self.assertNotIn(('carts.orderitem', self.order.items.get().pk), changed)
+        self.assertNotIn(('carts.cartitem', self.items[1].pk), changed)
+        self.assertEqual(keys(r for r in records if r.get('deleted')), {('carts.cartitem', deleted)})
+
+    def test_full_snapshot_when_the_last_one_is_too_old(self):
+        jobs.run_backup(storage=self.storage)
+        self.assertEqual(engine.plan()[0], 'INCREMENTAL')
+        with override_settings(BACKUP_FULL_INTERVAL_HOURS=24):
+            self.assertEqual(engine.plan(timezone.now() + timedelta(days=2)), ('FULL', None))
+
+    @override_settings(BACKUP_KEEP_FULL=2)
+    def test_prune_keeps_recent_fulls_and_drops_old_tombstones(self):
+        names = []
+        for n in range(3):
+            names.append(jobs.run_backup('FULL', storage=self.storage).name)
+            names.append(jobs.run_backup('INCREMENTAL', storage=self.storage).name)
+        self.items[0].delete()
+        self.assertEqual(Tombstone.objects.count(), 1)
+
+        latest = jobs.run_backup('FULL', storage=self.storage)
+
+        self.assertEqual(self.storage.list(), names[4:] + [latest.name])
+        self.assertEqual(Tombstone.objects.count(), 0)
+
+    def test_bulk_deletes_write_tombstones_in_bulk(self):
+        def delete_orders(lines):
+            orders = [Order.objects.create(user_id=9, order_number=f"ORD-D{lines}-{n}", total_amount=1) for n in range(3)]
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=n, variant_id=n, product_name="P",
+                          variant_name="V", sku="SKU", price=1, quantity=1)
+                for order in orders for n in range(lines)
+            ])
+            items = set(OrderItem.objects.filter(order__in=orders).values_list('pk', flat=True))
+            Tombstone.objects.all().delete()
+            with CaptureQueriesContext(connection) as ctx:
+                Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+            tombstones = set(Tombstone.objects.values_list('model', 'object_pk'))
+            expected = {('carts.order', str(order.pk)) for order in orders}
+            expected |= {('carts.orderitem', str(pk)) for pk in items}
+            self.assertEqual(tombstones, expected)
+            return len(ctx.captured_queries)
+
+        # The order items are read in one query and tombstoned in one INSERT,
+        # however many there are
+        self.assertEqual(delete_orders(2), delete_orders(20))
+
+    def test_deletes_outside_the_carts_models_write_tombstones_per_row(self):
+        user = User.objects.create_user("gone")
+        pk = user.pk
+        user.delete()
+        self.assertEqual(list(Tombstone.objects.values_list('model', 'object_pk')), [('auth.user', str(pk))])
+
+    def test_failed_delete_writes_no_tombstones(self):
+        order = Order.objects.create(user_id=9, order_number="ORD-F", total_amount=1)
+        with mock.patch('django.db.models.sql.DeleteQuery.delete_batch', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                order.delete()
+        self.assertFalse(Tombstone.objects.exists())
+        pk = order.pk
+        order.delete()
+        self.assertEqual(list(Tombstone.objects.values_list('model', 'object_pk')), [('carts.order', str(pk))])
+
+    def test_verified_purchases_are_not_backed_up(self):
+        VerifiedPurchase.objects.create(user_id=1, product_id=1)
+        jobs.run_backup(storage=self.storage)
+        with CaptureQueriesContext(connection) as ctx:
+            purchases.rebuild_verified_purchases()
+        self.assertLess(len(ctx.captured_queries), 10)
+        self.assertFalse(Tombstone.objects.exists())
+        run = jobs.run_backup(storage=self.storage)
+        self.assertNotIn('carts.verifiedpurchase', {r['model'] for r in read_backup(self.storage, run.name)[1]})
+
+    def test_failed_upload_is_recorded(self):
+        storage = mock.Mock(save=mock.Mock(side_effect=OSError("disk full")))
+        with self.assertRaises(OSError), self.assertLogs('backup.engine', 'ERROR'):
+            jobs.run_backup(storage=storage)
+        run = BackupRun.objects.get()
+        self.assertEqual((run.status, run.error), ('FAILED', 'disk full'))
+        # the failed run doesn't move the watermark
+        self.assertEqual(engine.plan(), ('FULL', None))
+
+    def test_trigger_queues_a_job_for_the_scheduler(self):
+        url = reverse('trigger_backup')
+        with mock.patch.dict(os.environ, {"BACKUP_SECRET": "s3cret"}):
+            self.assertEqual(self.client.post(url).status_code, 401)
+            response = self.client.post(f"{url}?kind=full", HTTP_X_BACKUP_SECRET="s3cret")
+            self.assertEqual(response.status_code, 202)
+            job = response.json()['job']
+            self.assertEqual((job['kind'], job['status']), ('FULL', 'PENDING'))
+            # a second trigger gets the queued job back
+            again = self.client.post(url, HTTP_X_BACKUP_SECRET="s3cret").json()
+            self.assertEqual((again['job']['id'], again['created']), (job['id'], False))
+            self.assertEqual(self.storage.list(), [])
+
+            with mock.patch.object(engine, 'get_storage', return_value=self.storage):
+                call_command('backup_scheduler', '--once', stdout=io.StringIO())
+
+            status = self.client.get(response.json()['status_url'], HTTP_X_BACKUP_SECRET="s3cret").json()['job']
+            self.assertEqual(status['status'], 'SUCCEEDED')
+            self.assertEqual(self.storage.list(), [status['name']])
+            self.assertEqual(self.client.get(reverse('backup_job', args=[0]), HTTP_X_BACKUP_SECRET="s3cret")
+                             .status_code, 404)
+
+
+class BackupJobTests(TestCase):
+    def test_only_one_backup_runs_at_a_time(self):
+        running = BackupRun.objects.create()
+        self.assertTrue(jobs.claim(running))
+        queued = BackupRun.objects.create()
+        with self.assertRaises(jobs.BackupInProgress):
+            jobs.claim(queued)
+        with self.assertRaises(jobs.BackupInProgress):
+            jobs.run_pending()
+        self.assertEqual(BackupRun.objects.get(pk=queued.pk).status, 'PENDING')
+
+    @override_settings(BACKUP_LEASE_SECONDS=60)
+    def test_a_stale_running_job_releases_the_lock(self):
+        dead = BackupRun.objects.create(status='RUNNING', started_at=timezone.now() - timedelta(hours=5),
+                                        heartbeat_at=timezone.now() - timedelta(minutes=5))
+        queued = BackupRun.objects.create()
+        self.assertTrue(jobs.claim(queued))
+        dead.refresh_from_db()
+        self.assertEqual((dead.status, dead.error), ('FAILED', 'lease expired'))
+
+    @override_settings(BACKUP_LEASE_SECONDS=60)
+    def test_heartbeat_keeps_a_long_backup_alive(self):
+        started = timezone.now() - timedelta(hours=5)
+        live = BackupRun.objects.create(status='RUNNING', started_at=started, heartbeat_at=started)
+        self.assertTrue(jobs.renew_lease(live))
+        self.assertEqual(jobs.fail_stale(), 0)
+        live.refresh_from_db()
+        self.assertEqual(live.status, 'RUNNING')
+
+        BackupRun.objects.filter(pk=live.pk).update(status='FAILED')
+        with self.assertLogs('backup.jobs', 'WARNING'):
+            self.assertFalse(jobs.renew_lease(live))
+
+    @override_settings(BACKUP_HEARTBEAT_INTERVAL=0.01)
+    def test_heartbeat_runs_until_the_block_exits(self):
+        run = BackupRun.objects.create(status='RUNNING')
+        beats = threading.Semaphore(0)
+        with mock.patch.object(jobs, 'renew_lease', side_effect=lambda r: beats.release() or True), \
+                mock.patch.object(jobs.connections, 'close_all'):
+            with jobs.heartbeat(run):
+                self.assertTrue(beats.acquire(timeout=5))
+                self.assertTrue(beats.acquire(timeout=5))
+            self.assertEqual([t for t in threading.enumerate() if t.name == f"backup-{run.id}-heartbeat"], [])
+
+    def test_concurrent_enqueue_returns_the_queued_job(self):
+        queued_or_running = jobs._queued_or_running
+        winner = []
+
+        def racing_check():
+            if not winner:
+                # Another trigger queues its job between our check and insert
+                winner.append(BackupRun.objects.create())
+                return None
+            return queued_or_running()
+
+        with mock.patch.object(jobs, '_queued_or_running', side_effect=racing_check):
+            run, created = jobs.enqueue('FULL')
+        self.assertEqual((run, created), (winner[0], False))
+        self.assertEqual(BackupRun.objects.count(), 1)
+
+    def test_claim_is_first_come(self):
+        run = BackupRun.objects.create()
+        self.assertTrue(jobs.claim(run))
+        run.status = 'SUCCEEDED'
+        run.save()
+        self.assertFalse(jobs.claim(run))
+
+    @override_settings(BACKUP_WINDOW_START_HOUR=23, BACKUP_WINDOW_HOURS=3)
+    def test_due_once_per_off_peak_window(self):
+        def at(hour, day=2):
+            return timezone.make_aware(timezone.datetime(2026, 1, day, hour, 30))
+
+        self.assertFalse(jobs.due(at(12)))
+        self.assertTrue(jobs.due(at(23)))
+        self.assertTrue(jobs.due(at(1, day=3)))
+        with mock.patch('django.utils.timezone.now', return_value=at(23, day=1)):
+            BackupRun.objects.create(status='SUCCEEDED')
+        # yesterday's backup is from the previous window
+        self.assertTrue(jobs.due(at(23)))
+        with mock.patch('django.utils.timezone.now', return_value=at(0, day=3)):
+            BackupRun.objects.create()
+        self.assertFalse(jobs.due(at(1, day=3)))
+
+
+def fake_response(status, payload=None, body=b''):
+    response = requests.Response()
+    response.status_code = status
+    if payload is not None:
+        body = json.dumps(payload).encode()
+    response._content = body
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class FakeGitHub:
+    """Just enough of the releases API for GitHubReleaseStorage."""
+
+    def __init__(self):
+        self.release = None
+        self.assets = {}
+        self.calls = []
+
+    def request(self, method, url, headers=None, params=None, data=None, json=None, **kwargs):
+        self.calls.append((method, url))
+        path = url.replace("https://api.github.com", "")
+        if path == "/repos/acme/carts/releases/tags/db-backups":
+            return fake_response(200, self.release) if self.release else fake_response(404, {})
+        if method == "POST" and path == "/repos/acme/carts/releases":
+            self.release = {"id": 9, "upload_url": "https://uploads.github.com/assets/9{?name,label}"}
+            return fake_response(201, self.release)
+        if method == "POST" and url == "https://uploads.github.com/assets/9":
+            asset_id = len(self.assets) + 1
+            self.assets[asset_id] = (params["name"], data.read())
+            assert len(self.assets[asset_id][1]) == int(headers["Content-Length"])
+            return fake_response(201, {"id": asset_id})
+        if path == "/repos/acme/carts/releases/9/assets":
+            return fake_response(200, [{"id": key, "name": name} for key, (name, _) in self.assets.items()])
+        if path.startswith("/repos/acme/carts/releases/assets/"):
+            asset_id = int(path.rsplit("/", 1)[1])
+            if method == "DELETE":
+                del self.assets[asset_id]
+                return fake_response(204)
+            return fake_response(200, body=self.assets[asset_id][1])
+        return fake_response(404, {})
+
+
+class GitHubReleaseStorageTests(TestCase):
+    def setUp(self):
+        self.github = FakeGitHub()
+        patcher = mock.patch.object(upstreams.get("github").session, "request", self.github.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = GitHubReleaseStorage(repo="acme/carts", token="t", tag="db-backups")
+
+    def test_round_trip(self):
+        Cart.objects.create(user_id=1)
+        run = jobs.run_backup(storage=self.storage)
+
+        self.assertEqual(self.storage.list(), [run.name])
+        header, records = read_backup(self.storage, run.name)
+        self.assertEqual(header['kind'], 'FULL')
+        self.assertEqual(len(records), run.rows)
+        # the release is looked up once and created on first use
+        self.assertEqual(sum(call == ("POST", "https://api.github.com/repos/acme/carts/releases")
+                             for call in self.github.calls), 1)
+
+        self.storage.delete(run.name)
+        self.assertEqual(self.storage.list(), [])
+
+
+def wipe():
+    User.groups.through.objects.all().delete()
+    VerifiedPurchase.objects.all().delete()
+    for model in reversed(engine.backup_models()):
+        model._base_manager.all()._raw_delete('default')
+
+
+@override_settings(BACKUP_WATERMARK_OVERLAP=0, BACKUP_RESTORE_BATCH_SIZE=2)
+class RestoreTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.storage = LocalStorage(tmp.name)
+        patcher = mock.patch('backup.management.commands.restore_backup.get_storage', return_value=self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user("admin", password="x")
+        self.user.groups.add(Group.objects.create(name="staff"))
+        self.cart = Cart.objects.create(user_id=1)
+        self.items = [
+            CartItem.objects.create(cart=self.cart, product_id=n, variant_id=n, product_name="P",
+                                    variant_name="V", sku="SKU", price=100, quantity=1)
+            for n in range(5)
+        ]
+        self.order = Order.objects.create(user_id=1, order_number="ORD-R1", total_amount=100)
+        Transaction.objects.create(order=self.order, stripe_session_id="cs_1", amount=100)
+
+    def restore(self, *args):
+        out = io.StringIO()
+        call_command('restore_backup', *args, stdout=out)
+        return out.getvalue()
+
+    def test_restores_full_and_incrementals(self):
+        jobs.run_backup(storage=self.storage)
+        created_at = Order.objects.values_list('created_at', flat=True).get()
+        self.order.status = 'CONFIRMED'
+        self.order.save(update_fields=['status', 'updated_at'])
+        self.items[0].delete()
+        jobs.run_backup(storage=self.storage)
+        cart_total = Cart.objects.get().total_amount
+        wipe()
+
+        output = self.restore()
+
+        self.assertIn("Restored", output)
+        order = Order.objects.get()
+        self.assertEqual((order.pk, order.status, order.created_at), (self.order.pk, 'CONFIRMED', created_at))
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('pk', flat=True)), [item.pk for item in self.items[1:]]
+        )
+        self.assertEqual(Cart.objects.get().total_amount, cart_total)
+        self.assertEqual(list(User.objects.get(pk=self.user.pk).groups.values_list('name', flat=True)), ["staff"])
+        # new rows get fresh ids after the restored ones
+        self.assertGreater(Order.objects.create(user_id=2, order_number="ORD-R2", total_amount=1).pk, self.order.pk)
+
+    def test_timestamps_restored_without_touching_field_definitions(self):
+        jobs.run_backup(storage=self.storage)
+        updated_at = Order.objects.values_list('updated_at', flat=True).get()
+        wipe()
+        field = Order._meta.get_field('updated_at')
+        flags = []
+        stream = self.storage.open(self.storage.list()[0])
+
+        restorer = restore.Restorer(progress=lambda message, verbosity: flags.append(field.auto_now))
+        restorer.restore([('full', restore.read_backup(lambda: stream), False)])
+
+        self.assertEqual(Order.objects.values_list('updated_at', flat=True).get(), updated_at)
+        self.assertTrue(flags)
+        self.assertTrue(all(flags))
+        self.assertTrue(stream.closed)
+
+    def test_sources_are_closed_when_the_restore_fails(self):
+        jobs.run_backup(storage=self.storage)
+        wipe()
+        streams = [self.storage.open(self.storage.list()[0]), io.BytesIO(b'not gzip')]
+        sources = [
+            ('full', restore.read_backup(lambda: streams[0]), False),
+            ('bad', restore.read_backup(lambda: streams[1]), True),
+        ]
+        with self.assertRaises(OSError):
+            restore.Restorer().restore(sources)
+        self.assertTrue(all(stream.closed for stream in streams))
+        self.assertFalse(Cart.objects.exists())
+
+    def test_rebuilds_verified_purchases(self):
+        OrderItem.objects.create(order=self.order, product_id=7, variant_id=7, product_name="P",
+                                 variant_name="V", sku="SKU", price=100, quantity=1)
+        Delivery.objects.create(order=self.order, status='DELIVERED')
+        purchases.sync_verified_purchases(self.order)
+        jobs.run_backup(storage=self.storage)
+        wipe()
+
+        output = self.restore()
+
+        self.assertIn("carts.verifiedpurchase: 1 rows rebuilt", output)
+        self.assertEqual(list(VerifiedPurchase.objects.values_list('user_id', 'product_id')), [(1, 7)])
+
+    def test_if_empty_skips_a_database_with_data(self):
+        jobs.run_backup(storage=self.storage)
+        self.assertIn("Skipping restore", self.restore('--if-empty'))
+        self.assertEqual(CartItem.objects.count(), 5)
+
+    def test_no_backup(self):
+        wipe()
+        with override_settings(GITHUB_REPO=""):
+            output = self.restore('--if-empty')
+        self.assertIn("No backup found", output)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_legacy_dump(self):
+        wipe()
+        legacy = [
+            {"model": "auth.user", "fields": {"username": "old", "password": "!", "groups": [["staff"]],
+                                              "user_permissions": [], "date_joined": "2024-01-01T00:00:00Z"}},
+            {"model": "carts.order", "pk": 1, "fields": {
+                "user_id": 1, "order_number": "ORD-OLD1", "status": "DELIVERED", "total_amount": 500,
+                "stripe_session_id": "cs_old", "payment_date": "2024-01-02T00:00:00Z",
+                "delivery_date": "2024-01-05T00:00:00Z", "created_at": "2024-01-01T00:00:00Z"}},
+            {"model": "carts.order", "pk": 2, "fields": {
+                "user_id": 1, "order_number": "ORD-OLD2", "status": "PENDING", "total_amount": 100,
+                "stripe_session_id": None, "payment_date": None, "delivery_date": None,
+                "created_at": "2024-01-03T00:00:00Z"}},
+            {"model": "orders.gone", "pk": 1, "fields": {}},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(legacy, f, indent=2)
+            f.flush()
+            output = self.restore('--file', f.name)
+
+        self.assertIn("orders.gone: 1 rows skipped", output)
+        self.assertEqual(dict(Order.objects.values_list('order_number', 'status')),
+                         {"ORD-OLD1": "CONFIRMED", "ORD-OLD2": "PENDING"})
+        txn = Transaction.objects.get()
+        self.assertEqual((txn.order_id, txn.stripe_session_id, txn.status), (1, "cs_old", "SUCCESSFUL"))
+        delivery = Delivery.objects.get()
+        self.assertEqual((delivery.order_id, delivery.status), (1, "DELIVERED"))
+        self.assertEqual(delivery.delivered_at.isoformat(), "2024-01-05T00:00:00+00:00")
+        old = User.objects.get(username="old")
+        self.assertEqual(list(old.groups.values_list('name', flat=True)), ["staff"])
+
+    def test_bad_file_rolls_back(self):
+        jobs.run_backup(storage=self.storage)
+        name = self.storage.list()[0]
+        path = os.path.join(self.storage.location, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        wipe()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        with self.assertRaises(Exception):
+            self.restore('--file', path)
+        self.assertFalse(Cart.objects.exists())
+
+
+class StreamParsingTests(SimpleTestCase):
+    def test_json_array_items_split_across_reads(self):
+        items = [{"model": "carts.order", "pk": n, "fields": {"note": "x" * n + "\u00e9"}} for n in range(50)]
+        data = json.dumps(items, indent=2, ensure_ascii=False).encode()
+        self.assertEqual(list(restore.iter_json_array(io.BytesIO(data), chunk_size=7)), items)
+        self.assertEqual(list(restore.iter_json_array(io.BytesIO(b" [ ] "))), [])
+        with self.assertRaises(ValueError):
+            list(restore.iter_json_array(io.BytesIO(b'[{"a": 1}, {"b"')))
+
+    def test_legacy_transform_leaves_current_rows_alone(self):
+        current = {"model": "carts.order", "pk": 3, "fields": {"status": "CONFIRMED", "total_amount": 1}}
+        self.assertEqual(list(restore.legacy_transform([current])), [current])
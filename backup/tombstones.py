@@ -0,0 +1,77 @@
+"""Tombstones for deleted rows, so incremental backups can carry deletes.
+
+Every backed-up model has a post_delete receiver, record_tombstone (see
+apps.py), so any delete that sends signals leaves its tombstones. The
+carts models delete through TombstoneQuerySet and TombstoneModel, which run
+Django's own delete() inside bulk_tombstones(): the tombstones for the
+whole delete, cascades included, are then written in one bulk INSERT in the
+delete's transaction rather than one INSERT per row. Elsewhere (auth.User,
+deleted one at a time) each tombstone is saved as its row goes.
+
+Raw deletes (QuerySet._raw_delete, used by restores) send no signals and
+write no tombstones.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import models, router, transaction
+
+_local = threading.local()
+
+
+def _pending(using):
+    """Stack of tombstone lists for the bulk_tombstones() blocks open on ``using``."""
+    if not hasattr(_local, 'pending'):
+        _local.pending = defaultdict(list)
+    return _local.pending[using]
+
+
+@contextmanager
+def bulk_tombstones(using):
+    """Write the tombstones of the deletes in the block together, when it ends."""
+    from .models import Tombstone
+
+    stack = _pending(using)
+    with transaction.atomic(using=using, savepoint=False):
+        stack.append([])
+        try:
+            yield
+        finally:
+            tombstones = stack.pop()
+        Tombstone.objects.using(using).bulk_create(tombstones)
+
+
+def record_tombstone(sender, instance, using, **kwargs):
+    from .models import Tombstone
+
+    tombstone = Tombstone(model=sender._meta.label_lower, object_pk=str(instance.pk))
+    stack = _pending(using)
+    if stack:
+        stack[-1].append(tombstone)
+    else:
+        tombstone.save(using=using)
+
+
+class TombstoneQuerySet(models.QuerySet):
+    def delete(self):
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        with bulk_tombstones(using):
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class TombstoneModel(models.Model):
+    objects = TombstoneQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        with bulk_tombstones(using):
+            return super().delete(using=using, keep_parents=keep_parents)
+
+    delete.alters_data = True
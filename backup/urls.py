@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path("backup/trigger/", views.trigger_backup, name="trigger_backup"),
+    path("backup/jobs/<int:run_id>/", views.backup_job, name="backup_job"),
 ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cart, CartItem, Order, OrderItem, Transaction, Delivery
+from .models import Cart, CartItem, Order, OrderItem, Transaction, Delivery, StockDeductionJob, StripeEvent, VerifiedPurchase
 
 admin.site.register(Cart)
 admin.site.register(CartItem)
@@ -7,3 +7,6 @@ admin.site.register(Order)
 admin.site.register(OrderItem)
 admin.site.register(Transaction)
 admin.site.register(Delivery)
+admin.site.register(StockDeductionJob)
+admin.site.register(StripeEvent)
+admin.site.register(VerifiedPurchase)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CartsConfig(AppConfig):
     name = 'carts'
+
+    def ready(self):
+        from . import signals  # noqa: F401
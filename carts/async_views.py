@@ -0,0 +1,108 @@
+"""Async versions of the views that spend most of their time waiting on
+upstream HTTP calls. Served under ASGI (core.asgi) when
+ASYNC_UPSTREAM_VIEWS is on, so one worker process can keep many upstream
+requests in flight instead of blocking a sync worker per request."""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+
+from .authentication import MicroserviceJWTAuthentication
+from .models import Cart, Order, Transaction
+from .serializers import CartItemSerializer
+from .services.cart_items import add_item
+from .services.payment_gateway import checkout_params, get_gateway, idempotency_key, is_reusable, transaction_defaults
+from .services.product_service import ProductServiceError, afetch_variant_and_product
+
+
+class AsyncJWTView(View):
+    """Plain async Django view with the same JWT auth as the DRF views."""
+
+    authentication = MicroserviceJWTAuthentication()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated API, exempt from CSRF like DRF's APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = self.authentication.authenticate(request)
+        except exceptions.APIException as e:
+            return JsonResponse({"detail": e.detail}, status=401)
+        if result is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        request.user = result[0]
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.ParseError as e:
+            return JsonResponse({"detail": e.detail}, status=400)
+
+    def parse_body(self, request):
+        # Malformed JSON is a 400 with DRF's message, as on the sync views
+        if request.content_type != 'application/json':
+            return request.POST
+        try:
+            data = json.loads(request.body or b'{}')
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise exceptions.ParseError(f"JSON parse error - {e}")
+        if not isinstance(data, dict):
+            raise exceptions.ParseError("JSON parse error - expected an object")
+        return data
+
+
+class AsyncAddToCartView(AsyncJWTView):
+    async def post(self, request):
+        user = request.user
+        data = self.parse_body(request)
+        cart, _ = await Cart.objects.aget_or_create(user_id=user.id, is_active=True)
+
+        product_slug = data.get('product_slug')
+        variant_id = int(data.get('variant_id'))
+        quantity = int(data.get('quantity', 1))
+
+        # --- Step 1: Fetch variant by ID and product by slug (concurrently) ---
+        try:
+            variant, product = await afetch_variant_and_product(variant_id, product_slug)
+        except ProductServiceError as e:
+            return JsonResponse({"error": e.message}, status=e.status)
+
+        # --- Step 2: Create or update cart item ---
+        cart_item = await sync_to_async(add_item)(cart, variant, product, product_slug, quantity)
+
+        return JsonResponse(CartItemSerializer(cart_item).data, status=201)
+
+
+class AsyncPayOrderView(AsyncJWTView):
+    async def post(self, request, order_id):
+        data = self.parse_body(request)
+        order = await Order.objects.aget(id=order_id, user_id=request.user.id)
+        if order.status != "PENDING":
+            return JsonResponse({"error": "Order already processed"}, status=400)
+
+        # Repeated clicks get the still-open session back without calling Stripe
+        open_txn = await order.transactions.filter(status='PENDING').order_by('-id').afirst()
+        if is_reusable(open_txn, order):
+            return JsonResponse({"checkout_url": open_txn.checkout_url}, status=200)
+
+        domain = request.build_absolute_uri('/')[:-1]
+        success_url = data.get('success_url', domain + '/payment-success?session_id={CHECKOUT_SESSION_ID}')
+        cancel_url = data.get('cancel_url', domain + '/payment-cancel')
+        items = [item async for item in order.items.all()]
+        params = checkout_params(order, items, request.user.id, success_url, cancel_url)
+
+        try:
+            checkout_session = await get_gateway().acreate_checkout_session(
+                params, idempotency_key(order, open_txn, params)
+            )
+            await Transaction.objects.aget_or_create(
+                stripe_session_id=checkout_session.id,
+                defaults=transaction_defaults(order, checkout_session),
+            )
+
+            return JsonResponse({"checkout_url": checkout_session.url}, status=200)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
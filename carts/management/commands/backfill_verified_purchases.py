@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from carts.services.purchases import rebuild_verified_purchases
+
+
+class Command(BaseCommand):
+    help = "Rebuild the verified purchases table from delivered orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rows = rebuild_verified_purchases(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} verified purchases"))
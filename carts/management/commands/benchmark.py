@@ -0,0 +1,506 @@
+import base64
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from carts.models import Cart, CartItem, Delivery, Order, OrderItem, Transaction
+from backup import engine as backup_engine, restore as backup_restore
+from carts.services.order_numbers import new_order_number
+
+
+class Rollback(Exception):
+    pass
+
+
+def bench_cart_totals(command, options):
+    """Cost of one cart mutation (add, update, delete) as the cart grows."""
+    mutations = options['iterations']
+    command.stdout.write(f"{'items':>8} {'us/mutation':>12} {'queries/mutation':>17}")
+    for size in options['sizes']:
+        try:
+            with transaction.atomic():
+                cart = Cart.objects.create(user_id=-1, is_active=False)
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product_id=n, variant_id=n, product_name='bench',
+                             variant_name='bench', sku='bench', price=100, quantity=1)
+                    for n in range(size)
+                ])
+                cart.update_total()
+                items = list(CartItem.objects.filter(cart=cart).select_related('cart')[:mutations])
+
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    for n in range(mutations):
+                        item = CartItem(cart=cart, product_id=-1, variant_id=size + n, product_name='bench',
+                                        variant_name='bench', sku='bench', price=100, quantity=1)
+                        item.save()
+                        items[n % len(items)].quantity += 1
+                        items[n % len(items)].save(update_fields=['quantity'])
+                        item.delete()
+                    elapsed = time.perf_counter() - start
+
+                count = mutations * 3
+                command.stdout.write(
+                    f"{size:>8} {elapsed / count * 1e6:>12.1f} {len(ctx.captured_queries) / count:>17.2f}"
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+
+# Indexes (and the partial unique constraint) added for the hot query paths
+QUERY_INDEXES = [
+    'unique_active_cart_per_user',
+    'order_user_recent',
+    'order_recent',
+    'orderitem_product_order',
+    'transaction_order_session',
+]
+
+
+def _seed_orders(rows, chunk=10000):
+    users = max(rows // 10, 1)
+    products = max(rows // 100, 1)
+    Cart.objects.bulk_create(
+        [Cart(user_id=user, is_active=True) for user in range(users)], batch_size=chunk
+    )
+    Cart.objects.bulk_create(
+        [Cart(user_id=random.randrange(users), is_active=False) for _ in range(users)], batch_size=chunk
+    )
+    for start in range(0, rows, chunk):
+        orders = Order.objects.bulk_create([
+            Order(user_id=random.randrange(users), order_number=f"BENCH-{n}", total_amount=100)
+            for n in range(start, min(start + chunk, rows))
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=random.randrange(products), variant_id=line,
+                      product_name='bench', variant_name='bench', sku='bench', price=50, quantity=1)
+            for order in orders for line in range(2)
+        ], batch_size=chunk)
+        Transaction.objects.bulk_create([
+            Transaction(order=order, stripe_session_id=f"cs_bench_{order.pk}", amount=100) for order in orders
+        ], batch_size=chunk)
+        Delivery.objects.bulk_create([
+            Delivery(order=order, status=random.choice(['PENDING', 'DELIVERED'])) for order in orders
+        ], batch_size=chunk)
+    return users, products
+
+
+def _index_queries(users, products):
+    user = random.randrange(users)
+    order = Order.objects.filter(user_id=user).only('id').first() or Order.objects.only('id').first()
+    return [
+        ("cart (CartView, AddToCartView)", Cart.objects.filter(user_id=user, is_active=True)),
+        ("order history (get-all-orders)", Order.objects.filter(user_id=user).order_by('-created_at', '-id')[:50]),
+        ("admin listing (admin-get-all-orders)", Order.objects.order_by('-created_at', '-id')[:50]),
+        ("webhook transaction lookup", Transaction.objects.filter(order=order, stripe_session_id=f"cs_bench_{order.pk}")),
+        ("verify purchase", OrderItem.objects.filter(
+            order__user_id=user, order__delivery__status='DELIVERED', product_id=random.randrange(products))),
+    ]
+
+
+def _report_queries(command, label, queries, iterations):
+    command.stdout.write(f"\n== {label} ==")
+    # The phase label makes the SQL text unique, so SQLite's prepared
+    # statement cache can't hand back a plan from before the indexes changed.
+    tag = f" /* {label} */"
+    with connection.cursor() as cursor:
+        for name, queryset in queries:
+            sql, params = queryset.query.sql_with_params()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                cursor.execute(sql + tag, params)
+                cursor.fetchall()
+            elapsed = (time.perf_counter() - start) / iterations
+            command.stdout.write(f"{name}: {elapsed * 1e3:.3f} ms")
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}{tag}", params)
+            for row in cursor.fetchall():
+                command.stdout.write(f"    {' '.join(str(col) for col in row)}")
+
+
+def bench_indexes(command, options):
+    """Plans and latencies of each endpoint's query with and without the query indexes.
+
+    Seeds ``--rows`` orders (plus items, transactions, deliveries and carts)
+    inside a transaction that is rolled back at the end.
+    """
+    try:
+        with transaction.atomic():
+            command.stdout.write(f"seeding {options['rows']} orders...")
+            users, products = _seed_orders(options['rows'])
+            queries = _index_queries(users, products)
+            _report_queries(command, "with query indexes", queries, options['iterations'])
+
+            # All of these (the partial unique constraint included) are plain
+            # indexes on SQLite and Postgres, and the drop is rolled back.
+            with connection.cursor() as cursor:
+                for name in QUERY_INDEXES:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+            _report_queries(command, "without query indexes", queries, options['iterations'])
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def uuid_order_number():
+    # The scheme CheckoutView used before carts.services.order_numbers
+    return f"ORD-{uuid.uuid4().hex[:8].upper()}"
+
+
+ORDER_NUMBER_SCHEMES = {
+    'uuid slice': uuid_order_number,
+    'time-ordered': new_order_number,
+}
+
+
+def _generate(args):
+    scheme, count = args
+    generate = ORDER_NUMBER_SCHEMES[scheme]
+    start = time.perf_counter()
+    numbers = [generate() for _ in range(count)]
+    return numbers, time.perf_counter() - start
+
+
+def bench_order_numbers(command, options):
+    """Generation rate and collisions across processes, then insert cost into
+    the unique index for each order-number scheme.
+
+    ``--iterations`` is the number of ids per process, ``--sizes`` the
+    process counts (2, 4 and one per CPU by default) and ``--rows`` the
+    orders inserted per scheme (rolled back).
+    """
+    count = options['iterations']
+    command.stdout.write(f"{'scheme':>14} {'procs':>6} {'ns/id':>8} {'ids':>10} {'duplicates':>11}")
+    ctx = multiprocessing.get_context('fork')
+    for scheme in ORDER_NUMBER_SCHEMES:
+        for procs in options['sizes']:
+            with ctx.Pool(procs) as pool:
+                results = pool.map(_generate, [(scheme, count)] * procs)
+            numbers = [number for batch, _ in results for number in batch]
+            per_id = max(elapsed for _, elapsed in results) / count
+            command.stdout.write(
+                f"{scheme:>14} {procs:>6} {per_id * 1e9:>8.0f} {len(numbers):>10} "
+                f"{len(numbers) - len(set(numbers)):>11}"
+            )
+
+    rows, chunk = options['rows'], 10000
+    command.stdout.write(f"\ninserting {rows} orders per scheme")
+    command.stdout.write(f"{'scheme':>14} {'total s':>9} {'last chunk us/row':>18}")
+    for scheme, generate in ORDER_NUMBER_SCHEMES.items():
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                for offset in range(0, rows, chunk):
+                    size = min(chunk, rows - offset)
+                    chunk_start = time.perf_counter()
+                    # uuid slices may collide at this volume; skip those rows
+                    Order.objects.bulk_create(
+                        [Order(user_id=n, order_number=generate(), total_amount=100) for n in range(size)],
+                        ignore_conflicts=True,
+                    )
+                    last_chunk = (time.perf_counter() - chunk_start) / size
+                total = time.perf_counter() - start
+                command.stdout.write(f"{scheme:>14} {total:>9.2f} {last_chunk * 1e6:>18.1f}")
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def bench_instrumentation(command, options):
+    """Per-request cost of TimingMiddleware and per-query cost of its DB wrapper."""
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+
+    from core import metrics
+    from core.middleware import TimingMiddleware
+
+    iterations = options['iterations']
+    request = RequestFactory().get('/bench/')
+    response = HttpResponse()
+
+    def view(request):
+        return response
+
+    def per_call(fn):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn(request)
+        return (time.perf_counter() - start) / iterations
+
+    middleware = TimingMiddleware(view)
+    overhead = per_call(middleware) - per_call(view)
+    command.stdout.write(f"middleware overhead: {overhead * 1e6:.2f} us/request")
+
+    with connection.cursor() as cursor:
+        def queries(request):
+            cursor.execute("SELECT 1")
+
+        bare = per_call(queries)
+        token = metrics.current.set(metrics.RequestStats())
+        try:
+            wrapped = per_call(queries)
+        finally:
+            metrics.current.reset(token)
+    command.stdout.write(f"db wrapper overhead: {(wrapped - bare) * 1e6:.2f} us/query")
+
+    def upstream(request):
+        with metrics.track_upstream("bench"):
+            pass
+
+    command.stdout.write(f"track_upstream:      {per_call(upstream) * 1e6:.2f} us/call")
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        size = fn()
+        return time.perf_counter() - start, tracemalloc.get_traced_memory()[1], size
+    finally:
+        tracemalloc.stop()
+
+
+def bench_backup(command, options):
+    """Peak memory and time of a backup: dumpdata + base64 (the old view) vs backup/engine.py.
+
+    Seeds ``--rows`` orders inside a transaction that is rolled back; nothing
+    is uploaded.
+    """
+    def dumpdata():
+        output = StringIO()
+        call_command("dumpdata", "carts", "auth.user", "--indent", "2",
+                     "--natural-foreign", "--natural-primary", stdout=output)
+        return len(base64.b64encode(output.getvalue().encode("utf-8")))
+
+    def stream():
+        with tempfile.TemporaryFile() as tmp:
+            backup_engine.write_backup(tmp, backup_engine.FULL, None, None)
+            return tmp.tell()
+
+    try:
+        with transaction.atomic():
+            command.stdout.write(f"seeding {options['rows']} orders...")
+            _seed_orders(options['rows'])
+            command.stdout.write(f"{'':<22} {'seconds':>8} {'peak MiB':>9} {'output MiB':>11}")
+            for label, fn in (("dumpdata + base64", dumpdata), ("streaming gzip NDJSON", stream)):
+                elapsed, peak, size = _measure(fn)
+                command.stdout.write(f"{label:<22} {elapsed:>8.2f} {peak / 2**20:>9.1f} {size / 2**20:>11.1f}")
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def bench_restore(command, options):
+    """Restore time: loaddata of a dumpdata file (the old build.sh) vs restore_backup.
+
+    Seeds ``--rows`` orders, dumps them both ways, then times each restore
+    into emptied tables; everything is rolled back.
+    """
+    def wipe():
+        for model in reversed(backup_engine.backup_models()):
+            model._base_manager.all()._raw_delete(connection.alias)
+
+    try:
+        with transaction.atomic():
+            command.stdout.write(f"seeding {options['rows']} orders...")
+            _seed_orders(options['rows'])
+            with tempfile.NamedTemporaryFile(suffix='.json') as dump, tempfile.TemporaryFile() as backup:
+                call_command("dumpdata", *backup_engine.MODELS, "--natural-foreign", output=dump.name)
+                backup_engine.write_backup(backup, backup_engine.FULL, None, None)
+                rows = sum(model._base_manager.count() for model in backup_engine.backup_models())
+
+                def loaddata():
+                    call_command("loaddata", dump.name, verbosity=0)
+
+                def restore():
+                    backup.seek(0)
+                    records = backup_restore.iter_backup(backup)
+                    backup_restore.Restorer().restore([("backup", records, False)])
+
+                command.stdout.write(f"{rows} rows")
+                for label, fn in (("loaddata", loaddata), ("restore_backup", restore)):
+                    with transaction.atomic():
+                        wipe()
+                        start = time.perf_counter()
+                        fn()
+                        elapsed = time.perf_counter() - start
+                        command.stdout.write(f"{label:<16} {elapsed:>8.2f} s {rows / elapsed:>10.0f} rows/s")
+                        transaction.set_rollback(True)
+            raise Rollback
+    except Rollback:
+        pass
+
+
+@contextmanager
+def _default_database(config):
+    # Connection wrappers are per thread and built from connections.settings
+    # on first use, so this thread's is dropped and every thread started
+    # inside the block connects with ``config``.
+    original = connections.settings['default']
+    connections['default'].close()
+    del connections['default']
+    connections.settings['default'] = config
+    try:
+        yield
+    finally:
+        connections['default'].close()
+        del connections['default']
+        connections.settings['default'] = original
+
+
+def _stub_product(variant_id, product_slug):
+    return {'id': variant_id, 'name': 'bench', 'sku': 'bench', 'price': 100}, {'product_id': 1, 'product_name': 'bench'}
+
+
+def _shopper(user_id, iterations, results):
+    """Two add-to-cart requests and a checkout per iteration, through the full WSGI stack."""
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory
+
+    handler = WSGIHandler()
+    factory = RequestFactory(HTTP_HOST='localhost')
+    token = AccessToken()
+    token['user_id'] = user_id
+    auth = {'HTTP_AUTHORIZATION': f"Bearer {token}"}
+    try:
+        for n in range(iterations):
+            for path, data in (
+                ('/api/cart/add/', {'product_slug': 'bench', 'variant_id': 2 * n, 'quantity': 1}),
+                ('/api/cart/add/', {'product_slug': 'bench', 'variant_id': 2 * n + 1, 'quantity': 1}),
+                ('/api/checkout/', {}),
+            ):
+                environ = factory.post(path, data, content_type='application/json', **auth).environ
+                start = time.perf_counter()
+                # Like a WSGI server: request_started/finished fire, so
+                # CONN_MAX_AGE decides whether the connection is kept
+                response = handler(environ, lambda status, headers: None)
+                response.close()
+                results.append((time.perf_counter() - start, response.status_code))
+    finally:
+        connections.close_all()
+
+
+def bench_db_concurrency(command, options):
+    """Throughput of concurrent add-to-cart and checkout requests, per database setup.
+
+    Compares a connection per request (and, on SQLite, the default rollback
+    journal and deferred transactions), as before DATABASE_URL, with the
+    configured DATABASES['default']. ``--sizes`` are thread counts and
+    ``--iterations`` the add, add, checkout rounds per thread. The products
+    service is stubbed. SQLite runs against a scratch file per setup;
+    elsewhere the rows are written to the configured database and deleted
+    afterwards.
+    """
+    configured = connections.settings['default']
+    sqlite = configured['ENGINE'] == 'django.db.backends.sqlite3'
+    setups = [
+        ('per-request', {**configured, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False,
+                         'OPTIONS': {} if sqlite else configured['OPTIONS']}),
+        ('configured', configured),
+    ]
+    command.stdout.write(f"{'setup':<12} {'threads':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    previous_disable = logging.root.manager.disable
+    # Failed requests are counted, not logged
+    logging.disable(logging.ERROR)
+    try:
+        with mock.patch('carts.views.fetch_variant_and_product', _stub_product):
+            for label, config in setups:
+                for threads in options['sizes']:
+                    if sqlite:
+                        fd, name = tempfile.mkstemp(suffix='.sqlite3')
+                        os.close(fd)
+                        config = {**config, 'NAME': name}
+                    with _default_database(config):
+                        if sqlite:
+                            call_command('migrate', verbosity=0)
+                        users = [-(n + 1) for n in range(threads)]
+                        results = []
+                        workers = [
+                            threading.Thread(target=_shopper, args=(user, options['iterations'], results))
+                            for user in users
+                        ]
+                        start = time.perf_counter()
+                        for worker in workers:
+                            worker.start()
+                        for worker in workers:
+                            worker.join()
+                        elapsed = time.perf_counter() - start
+                        if not sqlite:
+                            _delete_bench_rows(users)
+                    if sqlite:
+                        for suffix in ('', '-wal', '-shm'):
+                            if os.path.exists(name + suffix):
+                                os.remove(name + suffix)
+
+                    latencies = sorted(latency for latency, _ in results)
+                    statuses = Counter(code for _, code in results)
+                    errors = sum(n for code, n in statuses.items() if code >= 400)
+                    command.stdout.write(
+                        f"{label:<12} {threads:>7} {len(results) / elapsed:>8.1f} "
+                        f"{statistics.median(latencies) * 1e3:>8.1f} "
+                        f"{latencies[int(len(latencies) * 0.95)] * 1e3:>8.1f} {errors:>7}"
+                    )
+    finally:
+        logging.disable(previous_disable)
+
+
+def _delete_bench_rows(users):
+    # Raw deletes: no signals, so no backup tombstones for benchmark rows
+    orders = Order.objects.filter(user_id__in=users)
+    carts = Cart.objects.filter(user_id__in=users)
+    for queryset in (
+        OrderItem.objects.filter(order__in=orders), orders,
+        CartItem.objects.filter(cart__in=carts), carts,
+    ):
+        queryset._raw_delete(connection.alias)
+
+
+SCENARIOS = {
+    'backup': bench_backup,
+    'restore': bench_restore,
+    'cart_totals': bench_cart_totals,
+    'db_concurrency': bench_db_concurrency,
+    'indexes': bench_indexes,
+    'instrumentation': bench_instrumentation,
+    'order_numbers': bench_order_numbers,
+}
+
+# --sizes when not given; most scenarios read them as row counts
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+SCENARIO_SIZES = {
+    'order_numbers': sorted({2, 4, os.cpu_count() or 1}),
+}
+
+
+class Command(BaseCommand):
+    help = "Run a micro-benchmark scenario against the configured database (writes are rolled back or deleted)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--sizes', type=int, nargs='+')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--rows', type=int, default=1000000, help="Orders to seed (indexes, backup, restore) or insert (order_numbers).")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1")
+        if options['sizes'] is None:
+            options['sizes'] = SCENARIO_SIZES.get(options['scenario'], DEFAULT_SIZES)
+        SCENARIOS[options['scenario']](self, options)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+import httpx
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent requests at a running deployment and report throughput and latency "
+        "percentiles. Run it against the sync (core.wsgi) and async (core.asgi) deployments "
+        "with the same arguments to compare them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Full endpoint URL, e.g. http://127.0.0.1:8000/api/cart/add/")
+        parser.add_argument('--method', default='POST')
+        parser.add_argument('--data', default='{}', help="JSON request body.")
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--users', type=int, default=100, help="Spread requests over this many JWT user ids.")
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def handle(self, *args, **options):
+        tokens = []
+        for user_id in range(1, options['users'] + 1):
+            token = AccessToken()
+            token['user_id'] = user_id
+            tokens.append(str(token))
+        latencies, statuses, elapsed = asyncio.run(self.run(options, tokens))
+
+        latencies.sort()
+        def pct(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1e3
+
+        self.stdout.write(f"requests:    {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} req/s)")
+        self.stdout.write(f"concurrency: {options['concurrency']}")
+        self.stdout.write(
+            f"latency ms:  mean {statistics.mean(latencies) * 1e3:.1f}  p50 {pct(0.50):.1f}  "
+            f"p95 {pct(0.95):.1f}  p99 {pct(0.99):.1f}  max {latencies[-1] * 1e3:.1f}"
+        )
+        self.stdout.write("statuses:    " + ", ".join(f"{code}: {n}" for code, n in sorted(statuses.items(), key=str)))
+
+    async def run(self, options, tokens):
+        body = json.loads(options['data'])
+        queue = asyncio.Queue()
+        for n in range(options['requests']):
+            queue.put_nowait(n)
+        latencies, statuses = [], Counter()
+        limits = httpx.Limits(max_connections=options['concurrency'])
+
+        async with httpx.AsyncClient(timeout=options['timeout'], limits=limits) as client:
+            async def worker():
+                while not queue.empty():
+                    n = queue.get_nowait()
+                    headers = {'Authorization': f"Bearer {tokens[n % len(tokens)]}"}
+                    start = time.perf_counter()
+                    try:
+                        resp = await client.request(options['method'], options['url'], json=body, headers=headers)
+                        statuses[resp.status_code] += 1
+                    except httpx.HTTPError as e:
+                        statuses[type(e).__name__] += 1
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+            return latencies, statuses, time.perf_counter() - start
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from carts.services.stock_service import claim_jobs, process_job
+from core import upstreams
+
+
+class Command(BaseCommand):
+    help = "Drain the stock deduction outbox, applying batch-service deductions for paid orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process the currently due jobs and exit.")
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=settings.STOCK_JOB_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        upstreams.get("batches").warm()
+        while True:
+            jobs = claim_jobs(options['batch_size'])
+            for job in jobs:
+                if process_job(job):
+                    self.stdout.write(f"order {job.order_id}: stock deducted")
+                else:
+                    self.stderr.write(f"order {job.order_id}: attempt {job.attempts} failed: {job.last_error}")
+            if options['once'] and not jobs:
+                return
+            if not jobs:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:49
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def deactivate_duplicate_active_carts(apps, schema_editor):
+    # Keep each user's newest active cart so the partial unique index can be built
+    Cart = apps.get_model('carts', 'Cart')
+    duplicates = (
+        Cart.objects.filter(is_active=True)
+        .values('user_id')
+        .annotate(n=Count('id'), keep=Max('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        Cart.objects.filter(user_id=row['user_id'], is_active=True).exclude(id=row['keep']).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0007_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_id', '-created_at', '-id'], name='order_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at', '-id'], name='order_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['product_id', 'order'], name='orderitem_product_order'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['order', 'stripe_session_id'], name='transaction_order_session'),
+        ),
+        migrations.RunPython(deactivate_duplicate_active_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('user_id',), name='unique_active_cart_per_user'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+def backfill_verified_purchases(apps, schema_editor):
+    OrderItem = apps.get_model('carts', 'OrderItem')
+    VerifiedPurchase = apps.get_model('carts', 'VerifiedPurchase')
+    pairs = (
+        OrderItem.objects.filter(order__delivery__status='DELIVERED')
+        .values_list('order__user_id', 'product_id')
+        .distinct()
+    )
+    VerifiedPurchase.objects.bulk_create(
+        (VerifiedPurchase(user_id=user_id, product_id=product_id) for user_id, product_id in pairs.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0008_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerifiedPurchase',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_id', models.BigIntegerField()),
+                ('product_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'product_id'), name='unique_verified_purchase')],
+                'indexes': [models.Index(fields=['created_at'], name='verified_purchase_created')],
+            },
+        ),
+        migrations.RunPython(backfill_verified_purchases, migrations.RunPython.noop),
+    ]
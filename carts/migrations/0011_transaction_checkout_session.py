@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0010_order_number_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='checkout_url',
+            field=models.CharField(blank=True, default='', max_length=2048),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['order', 'status'], name='transaction_order_status'),
+        ),
+    ]
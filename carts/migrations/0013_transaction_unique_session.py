@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:05
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def dedupe_sessions(apps, schema_editor):
+    Transaction = apps.get_model('carts', 'Transaction')
+    Tombstone = apps.get_model('backup', 'Tombstone')
+    duplicated = (
+        Transaction.objects.values('stripe_session_id')
+        .annotate(rows=Count('id'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for session in duplicated:
+        # The webhook's get() failed on these, so the first row is as good as any
+        extra = Transaction.objects.filter(stripe_session_id=session['stripe_session_id']).exclude(id=session['keep'])
+        Tombstone.objects.bulk_create([
+            Tombstone(model='carts.transaction', object_pk=str(pk))
+            for pk in extra.values_list('id', flat=True)
+        ])
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup', '0001_initial'),
+        ('carts', '0012_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_sessions, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_order_session',
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='stripe_session_id',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-class Cart(models.Model):
+from backup.tombstones import TombstoneModel, TombstoneQuerySet
+
+class Cart(TombstoneModel):
     id = models.BigAutoField(primary_key=True)
     user_id = models.BigIntegerField()
     total_amount = models.BigIntegerField(default=0)
@@ -8,16 +13,49 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # Every cart lookup is (user_id, is_active=True); this partial
+            # index serves those and stops a user getting two active carts.
+            models.UniqueConstraint(
+                fields=['user_id'],
+                condition=models.Q(is_active=True),
+                name='unique_active_cart_per_user',
+            ),
+        ]
+
     def update_total(self):
-        total = sum(item.subtotal() for item in self.items.all())
-        self.total_amount = total
-        self.save(update_fields=['total_amount'])
+        Cart.recompute_total(self.pk)
+        self.refresh_from_db(fields=['total_amount', 'updated_at'])
+
+    @staticmethod
+    def recompute_total(cart_id):
+        # Full recompute, done by the database in a single UPDATE. Single-item
+        # mutations go through apply_total_delta() instead (see signals.py).
+        subtotal = (
+            CartItem.objects.filter(cart=OuterRef('pk'))
+            .values('cart')
+            .annotate(total=Sum(F('price') * F('quantity')))
+            .values('total')
+        )
+        Cart.objects.filter(pk=cart_id).update(
+            total_amount=Coalesce(Subquery(subtotal), 0),
+            updated_at=timezone.now(),
+        )
+
+    @staticmethod
+    def apply_total_delta(cart_id, delta):
+        if delta:
+            Cart.objects.filter(pk=cart_id).update(
+                total_amount=F('total_amount') + delta,
+                updated_at=timezone.now(),
+            )
 
     def __str__(self):
         return f"Cart {self.id}"
 
 
-class CartItem(models.Model):
+class CartItem(TombstoneModel):
     id = models.BigAutoField(primary_key=True)
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product_id = models.BigIntegerField()
@@ -28,10 +66,20 @@ class CartItem(models.Model):
     price = models.BigIntegerField()
     quantity = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('cart', 'variant_id')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this row contributes to the cart total in the database,
+        # so a save or delete can apply just the difference.
+        if 'price' in field_names and 'quantity' in field_names:
+            instance._saved_subtotal = instance.subtotal()
+        return instance
+
     def subtotal(self):
         return self.price * self.quantity
 
@@ -39,10 +87,16 @@ class CartItem(models.Model):
         return f"{self.variant_name} x {self.quantity}"
 
 
-class Order(models.Model):
+class OrderQuerySet(TombstoneQuerySet):
+    def with_details(self):
+        # Everything OrderSerializer touches, in a constant number of queries
+        return self.select_related('delivery').prefetch_related('items', 'transactions')
+
+
+class Order(TombstoneModel):
     id = models.BigAutoField(primary_key=True)
     user_id = models.BigIntegerField()
-    order_number = models.CharField(max_length=20, unique=True)
+    order_number = models.CharField(max_length=32, unique=True)
     status = models.CharField(
         max_length=20,
         default='PENDING',
@@ -53,13 +107,28 @@ class Order(models.Model):
         ],
     )
     total_amount = models.BigIntegerField()
+    # Client-supplied Idempotency-Key of the checkout that created this order
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'idempotency_key'], name='unique_order_idempotency_key'),
+        ]
+        indexes = [
+            # order history and the admin listing, newest first (keyset pagination)
+            models.Index(fields=['user_id', '-created_at', '-id'], name='order_user_recent'),
+            models.Index(fields=['-created_at', '-id'], name='order_recent'),
+        ]
 
     def __str__(self):
         return self.order_number
 
 
-class OrderItem(models.Model):
+class OrderItem(TombstoneModel):
     id = models.BigAutoField(primary_key=True)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
     product_id = models.BigIntegerField()
@@ -71,6 +140,12 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # VerifyPurchaseView: product_id, then join to the order
+            models.Index(fields=['product_id', 'order'], name='orderitem_product_order'),
+        ]
+
     def subtotal(self):
         return self.price * self.quantity
 
@@ -78,10 +153,11 @@ class OrderItem(models.Model):
         return f"{self.variant_name} x {self.quantity}"
 
 
-class Transaction(models.Model):
+class Transaction(TombstoneModel):
     id = models.BigAutoField(primary_key=True)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="transactions")
-    stripe_session_id = models.CharField(max_length=255)
+    # Unique, so concurrent PayOrderView get_or_create calls end up on one row
+    stripe_session_id = models.CharField(max_length=255, unique=True)
     amount = models.BigIntegerField()
     currency = models.CharField(max_length=10, default='inr')
     status = models.CharField(
@@ -93,14 +169,23 @@ class Transaction(models.Model):
             ('FAILED', 'Failed'),
         ],
     )
+    # Kept so PayOrderView can hand the same open session out again
+    checkout_url = models.CharField(max_length=2048, blank=True, default='')
+    expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # PayOrderView lookup of the order's open session
+            models.Index(fields=['order', 'status'], name='transaction_order_status'),
+        ]
+
     def __str__(self):
         return f"Transaction {self.stripe_session_id} - {self.status}"
 
 
-class Delivery(models.Model):
+class Delivery(TombstoneModel):
     id = models.BigAutoField(primary_key=True)
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name="delivery")
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
@@ -118,6 +203,78 @@ class Delivery(models.Model):
     )
     dispatched_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Delivery for {self.order.order_number} - {self.status}"
+
+
+class StockDeductionJob(TombstoneModel):
+    """Outbox row for the batch-service stock deduction of a paid order.
+
+    Written in the same transaction that confirms the order, and drained by
+    ``manage.py process_stock_jobs``. ``plan`` records the batch deductions
+    applied so far, so a retry only deducts the rest, planned from fresh
+    batch quantities. A job the batches can't cover ends FAILED.
+    """
+    id = models.BigAutoField(primary_key=True)
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name="stock_job")
+    status = models.CharField(
+        max_length=20,
+        default='PENDING',
+        choices=[
+            ('PENDING', 'Pending'),
+            ('RUNNING', 'Running'),
+            ('DONE', 'Done'),
+            ('FAILED', 'Failed'),
+        ],
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    plan = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='stockjob_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f"Stock deduction for {self.order_id} - {self.status}"
+
+
+class StripeEvent(TombstoneModel):
+    """Ledger of Stripe webhook events that have already been processed."""
+    id = models.BigAutoField(primary_key=True)
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+
+class VerifiedPurchase(models.Model):
+    """One row per (user, product) with at least one DELIVERED order.
+
+    Denormalized from OrderItem -> Order -> Delivery for VerifyPurchaseView;
+    kept in sync by carts.services.purchases.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user_id = models.BigIntegerField()
+    product_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'product_id'], name='unique_verified_purchase'),
+        ]
+        indexes = [
+            # the purchase filter's periodic sync of recent rows
+            models.Index(fields=['created_at'], name='verified_purchase_created'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} purchased product {self.product_id}"
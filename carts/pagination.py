@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Order
+
+ORDER_STATUSES = {choice for choice, _ in Order._meta.get_field('status').choices}
+
+
+def encode_cursor(order):
+    raw = json.dumps([order.created_at.isoformat(), order.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, order_id = json.loads(raw)
+        created_at = parse_datetime(created_at)
+        order_id = int(order_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValidationError({"cursor": "Invalid cursor"})
+    if created_at is None:
+        raise ValidationError({"cursor": "Invalid cursor"})
+    return created_at, order_id
+
+
+def _parse_bound(name, value, end_of_day=False):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: "Expected an ISO 8601 date or datetime"})
+        parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _page_size(value):
+    if value is None:
+        return settings.ORDERS_PAGE_SIZE
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValidationError({"page_size": "Must be an integer"})
+    return max(1, min(size, settings.ORDERS_MAX_PAGE_SIZE))
+
+
+def paginate_orders(request, queryset):
+    """Keyset-paginate ``queryset`` newest first over ``(created_at, id)``.
+
+    Supports ``status``, ``created_after`` and ``created_before`` filters.
+    Returns the page of orders and the opaque cursor for the next page
+    (``None`` on the last page). Every page is a single index range scan,
+    however deep the client has scrolled.
+    """
+    params = request.query_params
+
+    order_status = params.get('status')
+    if order_status:
+        if order_status not in ORDER_STATUSES:
+            raise ValidationError({"status": "Invalid status"})
+        queryset = queryset.filter(status=order_status)
+    if params.get('created_after'):
+        queryset = queryset.filter(created_at__gte=_parse_bound('created_after', params['created_after']))
+    if params.get('created_before'):
+        queryset = queryset.filter(
+            created_at__lte=_parse_bound('created_before', params['created_before'], end_of_day=True)
+        )
+
+    if params.get('cursor'):
+        created_at, order_id = decode_cursor(params['cursor'])
+        # The leading created_at <= bound keeps this a range scan on the index
+        queryset = queryset.filter(
+            Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__lt=order_id))
+        )
+
+    page_size = _page_size(params.get('page_size'))
+    orders = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_cursor = encode_cursor(orders[-1])
+    return orders, next_cursor
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Cart, CartItem, Order, OrderItem, Transaction, Delivery
 
@@ -28,6 +29,16 @@ class CartItemSerializer(serializers.ModelSerializer):
         return obj.subtotal()
 
 
+class CartLineSerializer(serializers.Serializer):
+    product_slug = serializers.CharField()
+    variant_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(default=1, min_value=1)
+
+
+class BatchAddToCartSerializer(serializers.Serializer):
+    items = CartLineSerializer(many=True, allow_empty=False, max_length=settings.CART_BATCH_MAX_LINES)
+
+
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
 
@@ -68,3 +79,32 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'user_id', 'order_number', 'status', 'total_amount', 'items', 'transactions', 'delivery']
+
+
+class PurchasePairSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    product_id = serializers.IntegerField()
+
+
+class BulkVerifyPurchaseSerializer(serializers.Serializer):
+    pairs = PurchasePairSerializer(many=True, allow_empty=False, max_length=settings.VERIFY_PURCHASE_BULK_MAX)
+
+
+class BatchVerifyPurchaseSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(required=False)
+    product_id = serializers.IntegerField(required=False)
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+        max_length=settings.VERIFY_PURCHASE_BATCH_MAX,
+    )
+    product_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+        max_length=settings.VERIFY_PURCHASE_BATCH_MAX,
+    )
+
+    def validate(self, data):
+        by_product = 'product_id' in data and 'user_ids' in data
+        by_user = 'user_id' in data and 'product_ids' in data
+        if by_product == by_user:
+            raise serializers.ValidationError("Send either product_id with user_ids, or user_id with product_ids.")
+        return data
@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded in-process LRU cache with per-entry TTL and stale-while-revalidate.
+
+    An entry younger than ``ttl`` is served as-is. Between ``ttl`` and
+    ``ttl + stale_ttl`` it is still served, but a single background refresh is
+    scheduled on ``executor``; with ``refresh_ahead`` that refresh starts that
+    many seconds before the entry expires instead. Anything older is treated
+    as a miss and loaded synchronously through ``loader(key)``. Concurrent
+    loads of one key share a single ``loader`` call. Loader errors are never
+    cached.
+    """
+
+    def __init__(self, name, loader, maxsize, ttl, stale_ttl=0, refresh_ahead=0, executor=None):
+        self.name = name
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self.executor = executor
+        self._data = OrderedDict()
+        self._refreshing = set()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+
+    def peek(self, key):
+        """Return the cached value for ``key`` or ``MISSING`` without loading it."""
+        refresh = False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age >= self.ttl + self.stale_ttl:
+                del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            if age < self.ttl:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            if age >= self.ttl - self.refresh_ahead and key not in self._refreshing and self.executor is not None:
+                self._refreshing.add(key)
+                refresh = True
+        if refresh:
+            self.executor.submit(self._refresh, key)
+        return value
+
+    def load(self, key):
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            value = self.loader(key)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+    def get(self, key):
+        value = self.peek(key)
+        if value is MISSING:
+            value = self.load(key)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=MISSING):
+        with self._lock:
+            if key is MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def _refresh(self, key):
+        try:
+            self.load(key)
+        except Exception:
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "refresh_ahead": self.refresh_ahead,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refresh_errors": self.refresh_errors,
+            }
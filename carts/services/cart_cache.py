@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+class LocMemBackend:
+    """In-process backend. Each worker has its own copy, so a bump made by one
+    worker is only seen by the others once their entries expire; keep the
+    timeout short or use the redis backend with more than one worker."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, timeout, only_if_missing=False):
+        with self._lock:
+            if only_if_missing and self._get(key) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Backend over any client with redis-py's ``get`` / ``set(nx=, ex=)``."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("CART_CACHE_BACKEND 'redis' requires the redis package")
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, timeout, only_if_missing=False):
+        return bool(self.client.set(key, json.dumps(value), ex=max(int(timeout), 1), nx=only_if_missing))
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if settings.CART_CACHE_BACKEND == 'locmem':
+            _backend = LocMemBackend()
+        elif settings.CART_CACHE_BACKEND == 'redis':
+            _backend = RedisBackend.from_url(settings.CART_CACHE_REDIS_URL)
+        else:
+            raise ImproperlyConfigured(f"Unknown CART_CACHE_BACKEND {settings.CART_CACHE_BACKEND!r}")
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def _version_key(user_id):
+    return f"cart:version:{user_id}"
+
+
+def _snapshot_key(user_id):
+    return f"cart:snapshot:{user_id}"
+
+
+def current_version(user_id):
+    """Opaque token that changes whenever the user's cart changes.
+
+    Tokens are random rather than counters, so a version key that expired
+    and was re-created can never match a snapshot taken before.
+    """
+    backend = get_backend()
+    version = backend.get(_version_key(user_id))
+    if version is None:
+        backend.set(_version_key(user_id), uuid.uuid4().hex, settings.CART_CACHE_TIMEOUT, only_if_missing=True)
+        version = backend.get(_version_key(user_id))
+    return version
+
+
+def bump_version(user_id):
+    # After commit, so a reader can never label pre-commit data with the new version
+    transaction.on_commit(
+        lambda: get_backend().set(_version_key(user_id), uuid.uuid4().hex, settings.CART_CACHE_TIMEOUT)
+    )
+
+
+def get_snapshot(user_id, version):
+    snapshot = get_backend().get(_snapshot_key(user_id))
+    if snapshot is not None and snapshot['version'] == version:
+        return snapshot['data']
+    return None
+
+
+def store_snapshot(user_id, version, data):
+    get_backend().set(_snapshot_key(user_id), {'version': version, 'data': data}, settings.CART_CACHE_TIMEOUT)
+
+
+def etag_for(version):
+    return f'"{version}"'
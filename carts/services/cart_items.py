@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+from . import cart_cache
+
+
+def add_item(cart, variant, product, product_slug, quantity):
+    """Add ``quantity`` of ``variant`` to ``cart`` and return the cart item.
+
+    Safe against concurrent adds of the same variant: a new row goes through
+    get_or_create (the loser of a race on the unique (cart, variant_id)
+    index falls through to the update), and an existing row is incremented
+    in the database with F() rather than from a value read earlier. The
+    cart total is then recomputed from the items in the same transaction,
+    so it can't drift from a stale baseline.
+    """
+    with transaction.atomic():
+        item, created = CartItem.objects.get_or_create(
+            cart=cart,
+            variant_id=variant['id'],
+            defaults={
+                'product_id': product.get('product_id'),
+                'product_name': product.get('product_name', product_slug),
+                'variant_name': variant.get('name', 'Unknown Variant'),
+                'sku': variant.get('sku', ''),
+                'price': variant.get('price', 0),
+                'quantity': quantity,
+            },
+        )
+        if created:
+            # the CartItem post_save signal has added it to the total
+            return item
+        CartItem.objects.filter(pk=item.pk).update(
+            quantity=F('quantity') + quantity,
+            price=variant.get('price', 0),
+            updated_at=timezone.now(),
+        )
+        Cart.recompute_total(cart.pk)
+        cart_cache.bump_version(cart.user_id)
+        item.refresh_from_db()
+    return item
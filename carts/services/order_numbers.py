@@ -0,0 +1,135 @@
+"""Time-ordered order numbers.
+
+An order number is ``ORD-`` followed by 18 Crockford base32 characters
+encoding a 90-bit, Snowflake-style id::
+
+    46 bits  milliseconds since ORDER_NUMBER_EPOCH_MS
+    10 bits  shard      (ORDER_NUMBER_SHARD, one per host/container)
+    22 bits  process id (unique among live processes on a host)
+    12 bits  sequence   (per millisecond, per process)
+
+The sequence makes numbers unique within a process, and the pid among the
+processes of one host. Across hosts it is only as unique as the shard: with
+ORDER_NUMBER_SHARD set to a distinct value per host two workers can't
+produce the same number, but shards derived from hostnames can clash. The
+unique index on Order.order_number is the backstop, and CheckoutView
+retries with a fresh number if it is ever hit.
+
+The fixed-width encoding sorts like the integer, so numbers are monotonic
+per process and roughly time-ordered overall, which keeps inserts at the
+right-hand edge of the unique index.
+"""
+import os
+import socket
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+PREFIX = "ORD-"
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+WIDTH = 18
+
+TIMESTAMP_BITS = 46
+SHARD_BITS = 10
+PID_BITS = 22
+SEQUENCE_BITS = 12
+
+MAX_SHARD = (1 << SHARD_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def default_shard():
+    # Hostnames are unique per container but 1024 shards aren't: two hosts
+    # collide with probability ~n^2/2048. Set ORDER_NUMBER_SHARD explicitly
+    # when running more than a handful of instances.
+    return zlib.crc32(socket.gethostname().encode()) & MAX_SHARD
+
+
+def encode(value):
+    chars = []
+    for _ in range(WIDTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return PREFIX + "".join(reversed(chars))
+
+
+def decode(order_number):
+    """Split an order number back into its fields."""
+    value = 0
+    for char in order_number[len(PREFIX):]:
+        value = value * 32 + ALPHABET.index(char)
+    sequence = value & MAX_SEQUENCE
+    value >>= SEQUENCE_BITS
+    pid = value & ((1 << PID_BITS) - 1)
+    value >>= PID_BITS
+    shard = value & MAX_SHARD
+    timestamp_ms = (value >> SHARD_BITS) + settings.ORDER_NUMBER_EPOCH_MS
+    return {"timestamp_ms": timestamp_ms, "shard": shard, "pid": pid, "sequence": sequence}
+
+
+class OrderNumberGenerator:
+    def __init__(self, shard, epoch_ms, clock=time.time):
+        if not 0 <= shard <= MAX_SHARD:
+            raise ValueError(f"shard must be between 0 and {MAX_SHARD}")
+        self.shard = shard
+        self.epoch_ms = epoch_ms
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid() & ((1 << PID_BITS) - 1)
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now_ms = int(self.clock() * 1000) - self.epoch_ms
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting
+                # from the last timestamp so numbers never go backwards.
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            value = self._last_ms
+            value = (value << SHARD_BITS) | self.shard
+            value = (value << PID_BITS) | self._pid
+            return (value << SEQUENCE_BITS) | self._sequence
+
+    def next(self):
+        return encode(self.next_id())
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                shard = settings.ORDER_NUMBER_SHARD
+                _generator = OrderNumberGenerator(
+                    default_shard() if shard is None else shard, settings.ORDER_NUMBER_EPOCH_MS
+                )
+    return _generator
+
+
+def _reset_after_fork():
+    # A forked child has a new pid and must not continue the parent's sequence
+    if _generator is not None:
+        _generator.reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def new_order_number():
+    return get_generator().next()
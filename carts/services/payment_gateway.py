@@ -0,0 +1,116 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import httpx
+import stripe
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core import upstreams
+from core.metrics import track_upstream
+
+
+class StripeGateway:
+    """Checkout sessions through a StripeClient with bounded timeouts.
+
+    Base URL, timeouts and the (warmed) connection pool come from the
+    "stripe" entry of the service registry. Stripe retries failed requests
+    itself (STRIPE_MAX_NETWORK_RETRIES), which is safe because every create
+    carries an idempotency key.
+    """
+
+    def __init__(self):
+        service = upstreams.get("stripe")
+        connect, read = service.timeout
+        self.client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            base_addresses={"api": service.base_url},
+            max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+            http_client=stripe.RequestsClient(
+                timeout=service.timeout,
+                session=service.session,
+                async_fallback_client=stripe.HTTPXClient(timeout=httpx.Timeout(read, connect=connect)),
+            ),
+        )
+
+    def create_checkout_session(self, params, idempotency_key):
+        with track_upstream("stripe"):
+            return self.client.v1.checkout.sessions.create(params, {"idempotency_key": idempotency_key})
+
+    async def acreate_checkout_session(self, params, idempotency_key):
+        with track_upstream("stripe"):
+            return await self.client.v1.checkout.sessions.create_async(params, {"idempotency_key": idempotency_key})
+
+
+_gateway = None
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        _gateway = import_string(settings.PAYMENT_GATEWAY)()
+    return _gateway
+
+
+def set_gateway(gateway):
+    global _gateway
+    _gateway = gateway
+
+
+def is_reusable(txn, order):
+    """Whether a pending transaction's session can be handed out again."""
+    margin = timedelta(seconds=settings.STRIPE_CHECKOUT_REUSE_MARGIN)
+    return (
+        txn is not None
+        and txn.amount == order.total_amount
+        and bool(txn.checkout_url)
+        and txn.expires_at is not None
+        and txn.expires_at > timezone.now() + margin
+    )
+
+
+def checkout_params(order, items, user_id, success_url, cancel_url):
+    return {
+        'line_items': [
+            {
+                'price_data': {
+                    'currency': 'inr',
+                    'product_data': {
+                        'name': f"{item.product_name} - {item.variant_name}",
+                    },
+                    'unit_amount': int(item.price * 100),  # Stripe expects amount in paisa
+                },
+                'quantity': item.quantity,
+            }
+            for item in items
+        ],
+        'mode': 'payment',
+        'success_url': success_url,
+        'cancel_url': cancel_url,
+        'metadata': {
+            'order_id': str(order.id),
+            'user_id': str(user_id),
+        },
+    }
+
+
+def idempotency_key(order, previous, params):
+    """Same key for the same order, predecessor session and payload.
+
+    Concurrent clicks therefore get the same Stripe session back, while a
+    replacement for an expiring session (``previous``) gets a fresh one.
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:32]
+    return f"checkout-{order.id}-{previous.id if previous else 0}-{digest}"
+
+
+def transaction_defaults(order, session):
+    return {
+        'order': order,
+        'amount': order.total_amount,
+        'status': 'PENDING',
+        'checkout_url': session.url,
+        'expires_at': datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc) if session.expires_at else None,
+    }
@@ -1,11 +1,229 @@
+import asyncio
+import contextvars
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 import requests
 from django.conf import settings
 
-PRODUCT_SERVICE_URL = settings.PRODUCT_SERVICE_URL
+from core import upstreams
+from core.metrics import track_upstream
+from . import resilience
+from .cache import MISSING, TTLCache
+
+# Base URL, pool, timeouts and retries come from the service registry
+service = upstreams.get("products")
+session = service.session
+TIMEOUT = service.timeout
+
+
+class ProductServiceError(Exception):
+    """Raised when the products service can't give us a usable answer.
+
+    ``status`` is the HTTP status the calling view should respond with.
+    """
+
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=service.pool_size,
+    thread_name_prefix="product-service",
+)
+
+
+def _submit(fn, *args):
+    # Run in a copy of the caller's context so the fetch counts toward its request timings
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _parse_json(resp, name):
+    if resp.status_code != 200:
+        raise ProductServiceError(f"{name} service unavailable", status=503)
+
+    try:
+        return resp.json()
+    except ValueError:
+        raise ProductServiceError(f"Invalid response from {name.lower()} service", status=502)
+
+
+def _get(path):
+    with track_upstream("products"):
+        return session.get(service.url(path), timeout=TIMEOUT)
+
+
+def _get_json(path, name):
+    try:
+        resp = resilience.products.call(
+            lambda: _get(path), failures=requests.RequestException, is_failure=resilience.is_server_error
+        )
+    except (requests.RequestException, resilience.UpstreamRejected):
+        raise ProductServiceError(f"{name} service unavailable", status=503)
+    return _parse_json(resp, name)
+
+
+def _check_variant(variant):
+    if not variant or 'id' not in variant:
+        raise ProductServiceError("Variant not found", status=404)
+    return variant
+
+
+def _check_product(product):
+    if not product.get("product_id"):
+        raise ProductServiceError("Product ID not found", status=404)
+    return product
+
+
+def fetch_variant(variant_id):
+    return _check_variant(_get_json(f"/api/variants/{variant_id}/", "Variant"))
+
+
+def fetch_product_by_slug(product_slug):
+    return _check_product(_get_json(f"/api/products/{product_slug}/", "Product"))
+
+
+# Variants carry the price, so they get the short price TTL and are never
+# served stale: a price older than the TTL is fetched again before it reaches
+# a cart. Hot variants are refreshed ahead of expiry instead, so they don't
+# stall a request every TTL. Product-by-slug lookups only give us product_id /
+# product_name and can live much longer.
+variant_cache = TTLCache(
+    "variants",
+    fetch_variant,
+    maxsize=settings.CATALOG_CACHE_MAXSIZE,
+    ttl=settings.CATALOG_CACHE_PRICE_TTL,
+    stale_ttl=0,
+    refresh_ahead=settings.CATALOG_CACHE_PRICE_REFRESH_AHEAD,
+    executor=_executor,
+)
+product_cache = TTLCache(
+    "products",
+    fetch_product_by_slug,
+    maxsize=settings.CATALOG_CACHE_MAXSIZE,
+    ttl=settings.CATALOG_CACHE_DESCRIPTIVE_TTL,
+    stale_ttl=settings.CATALOG_CACHE_DESCRIPTIVE_STALE_TTL,
+    executor=_executor,
+)
+
+
+def fetch_variant_and_product(variant_id, product_slug):
+    """Fetch a variant and its product, from cache where possible.
+
+    On a double miss the product lookup runs on the pool while the variant
+    lookup runs on the calling thread, so the total wait is the slower of the
+    two round trips. Errors are raised in the same order as the old
+    sequential calls.
+    """
+    product = product_cache.peek(product_slug)
+    product_future = None
+    if product is MISSING:
+        product_future = _submit(product_cache.load, product_slug)
+    try:
+        variant = variant_cache.get(variant_id)
+    except ProductServiceError:
+        if product_future is not None:
+            product_future.cancel()
+        raise
+    if product_future is not None:
+        product = product_future.result()
+    return variant, product
+
+
+def fetch_catalog(variant_ids, product_slugs):
+    """Resolve many variants and products at once.
+
+    The products service has no bulk lookup, so every cache miss is fetched
+    concurrently on the pool. Returns ``({variant_id: variant}, {slug: product})``
+    and raises the first ProductServiceError, variants before products.
+    """
+    variants, products, pending = {}, {}, []
+    for cache, keys, found in ((variant_cache, variant_ids, variants), (product_cache, product_slugs, products)):
+        for key in dict.fromkeys(keys):
+            value = cache.peek(key)
+            if value is MISSING:
+                pending.append((found, key, _submit(cache.load, key)))
+            else:
+                found[key] = value
+
+    try:
+        for found, key, future in pending:
+            found[key] = future.result()
+    except ProductServiceError:
+        for _, _, future in pending:
+            future.cancel()
+        raise
+    return variants, products
+
+
+def cache_stats():
+    return [variant_cache.stats(), product_cache.stats()]
+
+
+# --- Async client, used by the ASGI views (carts/async_views.py) ---
+
+def _async_client():
+    return service.async_client()
+
+
+async def _aget(path):
+    with track_upstream("products"):
+        return await _async_client().get(service.url(path))
+
+
+async def _aget_json(path, name):
+    # Same retry policy as the sync session: idempotent GETs only, exponential
+    # backoff plus jitter on connection errors and 502/503/504.
+    resp = None
+    for attempt in range(service.max_retries + 1):
+        try:
+            resp = await resilience.products.acall(
+                lambda: _aget(path), failures=httpx.HTTPError, is_failure=resilience.is_server_error
+            )
+        except resilience.UpstreamRejected:
+            resp = None
+            break
+        except httpx.HTTPError:
+            resp = None
+        if resp is not None and resp.status_code not in upstreams.RETRY_STATUSES:
+            break
+        if attempt < service.max_retries:
+            await asyncio.sleep(
+                service.backoff_factor * 2 ** attempt
+                + random.uniform(0, service.backoff_jitter)
+            )
+    if resp is None:
+        raise ProductServiceError(f"{name} service unavailable", status=503)
+    return _parse_json(resp, name)
+
+
+async def afetch_variant(variant_id):
+    return _check_variant(await _aget_json(f"/api/variants/{variant_id}/", "Variant"))
+
+
+async def afetch_product_by_slug(product_slug):
+    return _check_product(await _aget_json(f"/api/products/{product_slug}/", "Product"))
+
+
+async def _acached(cache, key, loader):
+    value = cache.peek(key)
+    if value is MISSING:
+        value = await loader(key)
+        cache.set(key, value)
+    return value
+
 
-def fetch_product(product_id):
-    response = requests.get(
-        f"{PRODUCT_SERVICE_URL}/api/products/{product_id}/"
+async def afetch_variant_and_product(variant_id, product_slug):
+    """Async twin of fetch_variant_and_product, sharing the same caches."""
+    variant, product = await asyncio.gather(
+        _acached(variant_cache, variant_id, afetch_variant),
+        _acached(product_cache, product_slug, afetch_product_by_slug),
+        return_exceptions=True,
     )
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    for result in (variant, product):
+        if isinstance(result, BaseException):
+            raise result
+    return variant, product
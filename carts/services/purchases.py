@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from carts.models import OrderItem, VerifiedPurchase
+from .bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+# Filter rebuilds run here, off the request path
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purchase-filter")
+
+
+def _key(user_id, product_id):
+    return f"{user_id}:{product_id}"
+
+
+class PurchaseFilter:
+    """Per-process bloom filter over verified (user_id, product_id) pairs.
+
+    Rebuilt from the table every VERIFIED_PURCHASE_BLOOM_REBUILD_SECONDS, on
+    a background thread: requests keep using the previous filter, and until
+    the first one is ready every pair goes to the indexed query. In
+    between, rows inserted by any process are picked up at most every
+    VERIFIED_PURCHASE_BLOOM_SYNC_SECONDS, and deliveries marked by this
+    process are added as soon as they commit. A pair the filter rejects is
+    answered "not purchased" without a query.
+
+    Both read the primary: a row missing from the filter is a wrong "no"
+    until the next rebuild. Syncs go by created_at and re-read the last
+    VERIFIED_PURCHASE_BLOOM_SYNC_OVERLAP seconds, since rows don't commit
+    in the order they were stamped (or numbered); adding a pair twice is
+    harmless.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.bloom = None
+            # Rows created before this are in the filter
+            self.watermark = None
+            self.built_at = 0
+            self.synced_at = 0
+            self.rejected = 0
+            self.passed = 0
+            self._rebuilding = False
+            # Pairs added while a rebuild reads the table, replayed into the new filter
+            self._pending = None
+
+    def warm(self):
+        """Start building the filter in the background, e.g. at worker start."""
+        self._refresh()
+
+    def rebuild(self):
+        with self._lock:
+            self._pending = []
+        purchases = VerifiedPurchase.objects.using(DEFAULT_DB_ALIAS)
+        watermark = timezone.now()
+        rows = purchases.count()
+        bloom = BloomFilter(
+            max(settings.VERIFIED_PURCHASE_BLOOM_CAPACITY, rows * 2),
+            settings.VERIFIED_PURCHASE_BLOOM_ERROR_RATE,
+        )
+        for user_id, product_id in purchases.values_list('user_id', 'product_id').iterator():
+            bloom.add(_key(user_id, product_id))
+        with self._lock:
+            for pair in self._pending:
+                bloom.add(_key(*pair))
+            self._pending = None
+            self.bloom = bloom
+            self.watermark = watermark
+            self.built_at = self.synced_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("verified purchase filter rebuild failed")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._pending = None
+
+    def _sync(self):
+        watermark = timezone.now()
+        since = self.watermark - timedelta(seconds=settings.VERIFIED_PURCHASE_BLOOM_SYNC_OVERLAP)
+        new_pairs = list(
+            VerifiedPurchase.objects.using(DEFAULT_DB_ALIAS).filter(created_at__gte=since)
+            .values_list('user_id', 'product_id')
+        )
+        with self._lock:
+            for pair in new_pairs:
+                self.bloom.add(_key(*pair))
+            self.watermark = max(self.watermark, watermark)
+            self.synced_at = time.monotonic()
+
+    def _refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            rebuild = not self._rebuilding and (
+                self.bloom is None or now - self.built_at >= settings.VERIFIED_PURCHASE_BLOOM_REBUILD_SECONDS
+            )
+            self._rebuilding = self._rebuilding or rebuild
+            sync = (
+                not rebuild and self.bloom is not None
+                and now - self.synced_at >= settings.VERIFIED_PURCHASE_BLOOM_SYNC_SECONDS
+            )
+        if rebuild:
+            _executor.submit(self._rebuild_in_background)
+        elif sync:
+            self._sync()
+
+    def candidates(self, pairs):
+        """Drop the pairs that are definitely not verified purchases."""
+        self._refresh()
+        with self._lock:
+            if self.bloom is None:
+                kept = list(pairs)
+            else:
+                kept = [pair for pair in pairs if _key(*pair) in self.bloom]
+            self.passed += len(kept)
+            self.rejected += len(pairs) - len(kept)
+        return kept
+
+    def add(self, pairs):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(pairs)
+            if self.bloom is not None:
+                for pair in pairs:
+                    self.bloom.add(_key(*pair))
+
+    def stats(self):
+        with self._lock:
+            stats = self.bloom.stats() if self.bloom is not None else {}
+            stats.update({
+                "rejected_without_query": self.rejected,
+                "passed_to_database": self.passed,
+                "watermark": self.watermark,
+                "age_seconds": time.monotonic() - self.built_at if self.bloom is not None else None,
+                "rebuilding": self._rebuilding,
+            })
+        return stats
+
+
+purchase_filter = PurchaseFilter()
+
+
+def delivered_pairs(queryset=None):
+    """Distinct (user_id, product_id) pairs backed by a DELIVERED order."""
+    if queryset is None:
+        queryset = OrderItem.objects.all()
+    return (
+        queryset.filter(order__delivery__status='DELIVERED')
+        .values_list('order__user_id', 'product_id')
+        .distinct()
+    )
+
+
+def sync_verified_purchases(order):
+    """Refresh the verified-purchase rows for ``order``'s user and products.
+
+    Called whenever the order's delivery status changes. A product stays
+    verified while any other delivered order of the same user contains it.
+    """
+    product_ids = set(order.items.values_list('product_id', flat=True))
+    if not product_ids:
+        return
+    delivered = {
+        product_id for _, product_id in
+        delivered_pairs(OrderItem.objects.filter(order__user_id=order.user_id, product_id__in=product_ids))
+    }
+    VerifiedPurchase.objects.bulk_create(
+        [VerifiedPurchase(user_id=order.user_id, product_id=product_id) for product_id in delivered],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(lambda: purchase_filter.add([(order.user_id, product_id) for product_id in delivered]))
+    VerifiedPurchase.objects.filter(user_id=order.user_id, product_id__in=product_ids - delivered).delete()
+
+
+def has_purchased(user_id, product_id):
+    if not purchase_filter.candidates([(user_id, product_id)]):
+        return False
+    return VerifiedPurchase.objects.filter(user_id=user_id, product_id=product_id).exists()
+
+
+def purchased_pairs(pairs):
+    """Subset of ``pairs`` [(user_id, product_id), ...] that are verified purchases.
+
+    Pairs the bloom filter rejects never reach the database; the rest are
+    checked with one query.
+    """
+    pairs = set(purchase_filter.candidates(list(set(pairs))))
+    if not pairs:
+        return set()
+    found = VerifiedPurchase.objects.filter(
+        user_id__in={user_id for user_id, _ in pairs},
+        product_id__in={product_id for _, product_id in pairs},
+    ).values_list('user_id', 'product_id')
+    return pairs & set(found)
+
+
+def rebuild_verified_purchases(batch_size=5000, using=DEFAULT_DB_ALIAS):
+    manager = VerifiedPurchase.objects.using(using)
+    with transaction.atomic(using=using):
+        manager.all().delete()
+        rows = 0
+        batch = []
+        for user_id, product_id in delivered_pairs(OrderItem.objects.using(using)).iterator(chunk_size=batch_size):
+            batch.append(VerifiedPurchase(user_id=user_id, product_id=product_id))
+            if len(batch) >= batch_size:
+                manager.bulk_create(batch)
+                rows += len(batch)
+                batch = []
+        manager.bulk_create(batch)
+    return rows + len(batch)
@@ -0,0 +1,272 @@
+"""Circuit breakers and bulkheads for the upstream services.
+
+A breaker tracks the outcome of the last UPSTREAM_BREAKER_WINDOW calls to
+one upstream. Once at least UPSTREAM_BREAKER_MIN_CALLS have been seen and
+the failure rate reaches UPSTREAM_BREAKER_FAILURE_RATE, it opens and calls
+fail immediately for UPSTREAM_BREAKER_OPEN_SECONDS. After that it lets
+UPSTREAM_BREAKER_HALF_OPEN_CALLS probes through: if they all succeed it
+closes, and any failure opens it again.
+
+A bulkhead caps the calls in flight to one upstream, so a slow dependency
+can only tie up that many threads (or tasks) per process; callers that
+can't get a slot within UPSTREAM_BULKHEAD_WAIT seconds are rejected.
+
+State is per process. It is exposed by ``stats()``, at
+/api/upstreams/stats/ and as gauges on /metrics/.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from core import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamRejected(Exception):
+    """The call was not attempted; the upstream is treated as unavailable."""
+
+    def __init__(self, upstream, reason):
+        super().__init__(f"{upstream} {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate, window, min_calls, open_seconds, half_open_calls, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise UpstreamRejected if the call must not go out."""
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise UpstreamRejected(self.name, "circuit open")
+                self.state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise UpstreamRejected(self.name, "circuit half-open")
+                self._probes += 1
+
+    def record(self, failed):
+        """Record a call's outcome; ``None`` means it never reached the upstream."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed is None:
+                    self._probes = max(self._probes - 1, 0)
+                elif failed:
+                    self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self.state = CLOSED
+                        self._outcomes.clear()
+                return
+            if failed is None:
+                return
+            self._outcomes.append(failed)
+            calls = len(self._outcomes)
+            if self.state == CLOSED and calls >= self.min_calls and sum(self._outcomes) / calls >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self._outcomes.clear()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.opened_at = None
+            self.rejected = 0
+            self._outcomes.clear()
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_failure_rate": sum(self._outcomes) / calls if calls else 0.0,
+                "rejected": self.rejected,
+            }
+
+
+class Bulkhead:
+    def __init__(self, name, max_concurrent, wait, max_concurrent_async=None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_concurrent_async = max_concurrent_async or max_concurrent
+        self.wait = wait
+        self.in_flight = 0
+        self.rejected = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        # asyncio semaphores belong to one event loop, like the httpx clients
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _rejected(self):
+        with self._lock:
+            self.rejected += 1
+        return UpstreamRejected(self.name, "bulkhead full")
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        if not self._semaphore.acquire(timeout=self.wait):
+            raise self._rejected()
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrent_async)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.wait)
+        except asyncio.TimeoutError:
+            raise self._rejected()
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+            semaphore.release()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_concurrent_async": self.max_concurrent_async,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+
+class Upstream:
+    """Breaker plus bulkhead for one upstream.
+
+    ``call`` / ``acall`` run ``fn`` inside a bulkhead slot once the breaker
+    allows it. Exceptions listed in ``failures`` count as upstream failures,
+    and so do results for which ``is_failure(result)`` is true (5xx). Other
+    responses, a 404 included, count as the upstream being healthy; other
+    exceptions aren't counted either way.
+    """
+
+    def __init__(self, name, max_concurrent, max_concurrent_async=None):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            failure_rate=settings.UPSTREAM_BREAKER_FAILURE_RATE,
+            window=settings.UPSTREAM_BREAKER_WINDOW,
+            min_calls=settings.UPSTREAM_BREAKER_MIN_CALLS,
+            open_seconds=settings.UPSTREAM_BREAKER_OPEN_SECONDS,
+            half_open_calls=settings.UPSTREAM_BREAKER_HALF_OPEN_CALLS,
+        )
+        self.bulkhead = Bulkhead(name, max_concurrent, settings.UPSTREAM_BULKHEAD_WAIT, max_concurrent_async)
+
+    def call(self, fn, failures, is_failure=lambda result: False):
+        self.breaker.before_call()
+        failed = None
+        try:
+            with self.bulkhead.slot():
+                try:
+                    result = fn()
+                except failures:
+                    failed = True
+                    raise
+                failed = is_failure(result)
+                return result
+        finally:
+            self.breaker.record(failed)
+
+    async def acall(self, fn, failures, is_failure=lambda result: False):
+        self.breaker.before_call()
+        failed = None
+        try:
+            async with self.bulkhead.aslot():
+                try:
+                    result = await fn()
+                except failures:
+                    failed = True
+                    raise
+                failed = is_failure(result)
+                return result
+        finally:
+            self.breaker.record(failed)
+
+    def stats(self):
+        return {"name": self.name, "breaker": self.breaker.stats(), "bulkhead": self.bulkhead.stats()}
+
+
+def is_server_error(resp):
+    return resp.status_code >= 500
+
+
+products = Upstream("products", settings.UPSTREAM_BULKHEAD_PRODUCTS, settings.UPSTREAM_BULKHEAD_PRODUCTS_ASYNC)
+batches = Upstream("batches", settings.UPSTREAM_BULKHEAD_BATCHES)
+
+UPSTREAMS = [products, batches]
+
+
+def stats():
+    return [upstream.stats() for upstream in UPSTREAMS]
+
+
+class _Collector:
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def render(self):
+        lines = [
+            "# HELP upstream_circuit_state Circuit breaker state (0 closed, 1 half-open, 2 open).",
+            "# TYPE upstream_circuit_state gauge",
+        ]
+        lines += [
+            f'upstream_circuit_state{{target="{u.name}"}} {self.STATE_VALUES[u.breaker.state]}' for u in UPSTREAMS
+        ]
+        lines += ["# HELP upstream_in_flight Calls in flight per upstream.", "# TYPE upstream_in_flight gauge"]
+        lines += [f'upstream_in_flight{{target="{u.name}"}} {u.bulkhead.in_flight}' for u in UPSTREAMS]
+        lines += ["# HELP upstream_rejected_total Calls rejected without being attempted.",
+                  "# TYPE upstream_rejected_total counter"]
+        for u in UPSTREAMS:
+            lines.append(f'upstream_rejected_total{{target="{u.name}",reason="circuit"}} {u.breaker.rejected}')
+            lines.append(f'upstream_rejected_total{{target="{u.name}",reason="bulkhead"}} {u.bulkhead.rejected}')
+        return lines
+
+
+metrics.REGISTRY.append(_Collector())
@@ -0,0 +1,179 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from carts.models import StockDeductionJob
+from core.metrics import track_upstream
+from core import upstreams
+from . import resilience
+
+service = upstreams.get("batches")
+session = service.session
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.STOCK_JOB_CONCURRENCY,
+    thread_name_prefix="stock-service",
+)
+
+
+class StockServiceError(Exception):
+    pass
+
+
+class StockShortfall(StockServiceError):
+    """The active batches can't cover the order; retrying won't help."""
+
+
+def _call(fn):
+    return resilience.batches.call(fn, failures=requests.RequestException, is_failure=resilience.is_server_error)
+
+
+def _get_batches(variant_id):
+    with track_upstream("batches"):
+        return session.get(service.url("/"), params={"variant": variant_id, "is_active": "true"}, timeout=service.timeout)
+
+
+def _patch_batch(batch_id, qty):
+    with track_upstream("batches"):
+        return session.patch(service.url(f"/{batch_id}/"), json={"qty": qty}, timeout=service.timeout)
+
+
+def fetch_batches(variant_id):
+    try:
+        resp = _call(lambda: _get_batches(variant_id))
+    except (requests.RequestException, resilience.UpstreamRejected) as e:
+        raise StockServiceError(f"Cannot fetch batches for variant {variant_id}: {e}")
+    if resp.status_code != 200:
+        raise StockServiceError(f"Cannot fetch batches for variant {variant_id}")
+    return resp.json()
+
+
+def update_batch(batch_id, qty):
+    try:
+        resp = _call(lambda: _patch_batch(batch_id, qty))
+    except (requests.RequestException, resilience.UpstreamRejected) as e:
+        raise StockServiceError(f"Failed to update batch {batch_id}: {e}")
+    if resp.status_code != 200:
+        raise StockServiceError(f"Failed to update batch {batch_id}")
+
+
+def remaining(job):
+    """{variant_id: quantity} of ``job``'s order not yet deducted by an applied step."""
+    wanted = defaultdict(int)
+    for variant_id, quantity in job.order.items.values_list('variant_id', 'quantity'):
+        wanted[variant_id] += quantity
+    for step in job.plan or []:
+        wanted[step['variant_id']] -= step['deducted']
+    return {variant_id: quantity for variant_id, quantity in wanted.items() if quantity > 0}
+
+
+def build_plan(wanted):
+    """Plan the deduction of ``wanted`` ({variant_id: quantity}) from fresh batch data.
+
+    Batches for all variants are fetched concurrently, then each variant's
+    quantity is taken FIFO by ``exp_date``. Returns the steps, each
+    ``{"batch_id", "variant_id", "deducted", "qty"}`` where ``qty`` is the
+    batch's new absolute quantity, and ``{variant_id: quantity}`` that no
+    batch could cover.
+    """
+    variant_ids = list(wanted)
+    plan = []
+    short = {}
+    for variant_id, batches in zip(variant_ids, _executor.map(fetch_batches, variant_ids)):
+        qty_to_deduct = wanted[variant_id]
+        for batch in sorted(batches, key=lambda x: x['exp_date']):
+            if qty_to_deduct <= 0:
+                break
+            available_qty = batch['qty']
+            deduct_qty = min(qty_to_deduct, available_qty)
+            if deduct_qty <= 0:
+                continue
+            qty_to_deduct -= deduct_qty
+            plan.append({
+                "batch_id": batch['batch_id'],
+                "variant_id": variant_id,
+                "deducted": deduct_qty,
+                "qty": available_qty - deduct_qty,
+            })
+        if qty_to_deduct > 0:
+            short[variant_id] = qty_to_deduct
+    return plan, short
+
+
+def run_job(job):
+    """Deduct whatever of the order's stock hasn't been deducted yet.
+
+    The batch service only takes absolute quantities, so every attempt
+    plans from batches fetched on that attempt; a quantity read by an
+    earlier attempt would overwrite the deductions other orders made since.
+    ``job.plan`` records the steps that were applied, saved as each PATCH
+    succeeds, and a retry only plans what they don't cover.
+    """
+    steps, short = build_plan(remaining(job))
+    job.plan = job.plan or []
+    pending = {_executor.submit(update_batch, step['batch_id'], step['qty']): step for step in steps}
+    error = None
+    for future in as_completed(pending):
+        try:
+            future.result()
+        except StockServiceError as e:
+            error = error or e
+            continue
+        job.plan.append(pending[future])
+        job.save(update_fields=['plan', 'updated_at'])
+    if error is not None:
+        raise error
+    if short:
+        raise StockShortfall(
+            "Not enough stock: " + ", ".join(f"variant {v} short by {q}" for v, q in sorted(short.items()))
+        )
+
+
+def claim_jobs(limit):
+    """Mark up to ``limit`` due jobs RUNNING and return them.
+
+    RUNNING jobs untouched for STOCK_JOB_LEASE seconds belong to a worker
+    that died mid-job and are picked up again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.STOCK_JOB_LEASE)
+    with transaction.atomic():
+        jobs = list(
+            StockDeductionJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(Q(status='PENDING', run_after__lte=now) | Q(status='RUNNING', updated_at__lt=stale))
+            .select_related('order')
+            .order_by('id')[:limit]
+        )
+        StockDeductionJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status='RUNNING', attempts=F('attempts') + 1, updated_at=now
+        )
+    for job in jobs:
+        job.status = 'RUNNING'
+        job.attempts += 1
+    return jobs
+
+
+def process_job(job):
+    try:
+        run_job(job)
+    except Exception as e:
+        # What stock there was has been deducted; the rest needs a person
+        if isinstance(e, StockShortfall) or job.attempts >= settings.STOCK_JOB_MAX_ATTEMPTS:
+            job.status = 'FAILED'
+        else:
+            job.status = 'PENDING'
+            delay = min(settings.STOCK_JOB_RETRY_BASE * 2 ** (job.attempts - 1), 3600)
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+        job.last_error = str(e)
+        job.save(update_fields=['status', 'run_after', 'last_error', 'updated_at'])
+        return False
+    job.status = 'DONE'
+    job.last_error = ''
+    job.save(update_fields=['status', 'last_error', 'updated_at'])
+    return True
@@ -1,8 +1,47 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import CartItem
+from .models import Cart, CartItem
+from .services import cart_cache
+
+# Each CartItem write moves the cart total by exactly what that row changed,
+# in one atomic UPDATE, without loading the cart or its other items.
+# Bulk writes (which skip signals) must call Cart.update_total() themselves.
+# The delta is taken from the subtotal the instance was loaded with, so a
+# save must start from a row nobody else can change meanwhile: the update
+# and delete views lock it, and adding to an existing item goes through
+# services.cart_items.add_item (an F() update and a full recompute) instead.
+# Both receivers also bump the owner's cart snapshot version.
+
+
+def _cart_owner(instance):
+    # Free when the cart was loaded with the item (the views make sure of it)
+    if CartItem.cart.is_cached(instance):
+        return instance.cart.user_id
+    return Cart.objects.filter(pk=instance.cart_id).values_list('user_id', flat=True).first()
+
+
+def _bump_cart_version(instance):
+    user_id = _cart_owner(instance)
+    if user_id is not None:
+        cart_cache.bump_version(user_id)
+
 
 @receiver(post_save, sender=CartItem)
+def apply_cart_item_save(sender, instance, created, **kwargs):
+    previous = 0 if created else getattr(instance, '_saved_subtotal', None)
+    if previous is None:
+        Cart.recompute_total(instance.cart_id)
+    else:
+        Cart.apply_total_delta(instance.cart_id, instance.subtotal() - previous)
+    instance._saved_subtotal = instance.subtotal()
+    _bump_cart_version(instance)
+
+
 @receiver(post_delete, sender=CartItem)
-def update_cart_total(sender, instance, **kwargs):
-    instance.cart.update_total()
+def apply_cart_item_delete(sender, instance, **kwargs):
+    previous = getattr(instance, '_saved_subtotal', None)
+    if previous is None:
+        Cart.recompute_total(instance.cart_id)
+    else:
+        Cart.apply_total_delta(instance.cart_id, -previous)
+    _bump_cart_version(instance)
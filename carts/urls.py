@@ -1,14 +1,23 @@
+from django.conf import settings
 from django.urls import path
+from carts.async_views import AsyncAddToCartView, AsyncPayOrderView
 from carts.views import (
-    CartView, AddToCartView, UpdateCartItemView, DeleteCartItemView,
+    CartView, AddToCartView, BatchAddToCartView, UpdateCartItemView, DeleteCartItemView,
     CheckoutView, PayOrderView, OrderPayStatusView, StripeWebhookView,
     get_all_ordersView, CancelOrderView, ActivenowView, admin_get_all_ordersView,
-    AdminUpdateOrderStatusView, VerifyPurchaseView, GetOrderView, AdminGetOrderView
+    AdminUpdateOrderStatusView, VerifyPurchaseView, GetOrderView, AdminGetOrderView,
+    CatalogCacheStatsView, BulkVerifyPurchaseView, BatchVerifyPurchaseView, PurchaseFilterStatsView,
+    UpstreamStatsView,
 )
 
+# Under ASGI the upstream-bound views run as async views (see carts/async_views.py)
+if settings.ASYNC_UPSTREAM_VIEWS:
+    AddToCartView, PayOrderView = AsyncAddToCartView, AsyncPayOrderView
+
 urlpatterns = [
     path('cart/', CartView.as_view(), name='cart-detail'),
     path('cart/add/', AddToCartView.as_view(), name='cart-add'),
+    path('cart/add/batch/', BatchAddToCartView.as_view(), name='cart-add-batch'),
     path('cart/item/<int:item_id>/update/', UpdateCartItemView.as_view(), name='cart-item-update'),
     path('cart/item/<int:item_id>/delete/', DeleteCartItemView.as_view(), name='cart-item-delete'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
@@ -22,6 +31,11 @@ urlpatterns = [
     path('admin-orders/<int:order_id>/', AdminGetOrderView.as_view(), name='admin-get-order'),
     path('admin-orders/<int:order_id>/status/', AdminUpdateOrderStatusView.as_view(), name='admin-update-order-status'),
     path('verify-purchase/<int:user_id>/<int:product_id>/', VerifyPurchaseView.as_view(), name='verify-purchase'),
+    path('verify-purchase/bulk/', BulkVerifyPurchaseView.as_view(), name='verify-purchase-bulk'),
+    path('verify-purchase/batch/', BatchVerifyPurchaseView.as_view(), name='verify-purchase-batch'),
+    path('verify-purchase/filter/stats/', PurchaseFilterStatsView.as_view(), name='verify-purchase-filter-stats'),
     path('active/', ActivenowView.as_view(), name='active'),
+    path('catalog-cache/stats/', CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
+    path('upstreams/stats/', UpstreamStatsView.as_view(), name='upstream-stats'),
 
 ]
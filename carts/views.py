@@ -1,23 +1,30 @@
+import logging
+
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-import uuid
-import requests
 from rest_framework import serializers
-from .models import Cart, CartItem, Order, OrderItem, Transaction, Delivery
-from .serializers import CartSerializer, CartItemSerializer, OrderSerializer
+from core.db_router import pin, replica_reads
+from .models import Cart, CartItem, Order, OrderItem, Transaction, Delivery, StockDeductionJob, StripeEvent
+from .serializers import BatchAddToCartSerializer, BatchVerifyPurchaseSerializer, BulkVerifyPurchaseSerializer, CartSerializer, CartItemSerializer, OrderSerializer
 from .authentication import MicroserviceJWTAuthentication
+from .pagination import paginate_orders
+from .services import cart_cache, resilience
+from .services.cart_items import add_item
+from .services.order_numbers import new_order_number
+from .services.payment_gateway import checkout_params, get_gateway, idempotency_key, is_reusable, transaction_defaults
+from .services.purchases import has_purchased, purchase_filter, purchased_pairs, sync_verified_purchases
+from .services.product_service import ProductServiceError, cache_stats, fetch_catalog, fetch_variant_and_product
 from rest_framework.permissions import AllowAny
 import stripe
 from django.conf import settings
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
-PRODUCT_SERVICE_API = "https://products-k4ov.onrender.com/api/variants/"
-BATCH_SERVICE_API = "https://products-k4ov.onrender.com/api/batches/"
+logger = logging.getLogger(__name__)
 
 
 # ----------------- Cart -----------------
@@ -30,6 +37,22 @@ class CartView(generics.RetrieveAPIView):
         cart, _ = Cart.objects.get_or_create(user_id=self.request.user.id, is_active=True)
         return cart
 
+    def retrieve(self, request, *args, **kwargs):
+        # Serve the cached snapshot while the cart's version is unchanged, and
+        # a bare 304 when the client already holds that version.
+        user_id = request.user.id
+        version = cart_cache.current_version(user_id)
+        etag = cart_cache.etag_for(version)
+        headers = {'ETag': etag}
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        data = cart_cache.get_snapshot(user_id, version)
+        if data is None:
+            data = self.get_serializer(self.get_object()).data
+            cart_cache.store_snapshot(user_id, version, data)
+        return Response(data, headers=headers)
+
 
 class AddToCartView(APIView):
     permission_classes = [IsAuthenticated]
@@ -42,64 +65,92 @@ class AddToCartView(APIView):
         product_slug = request.data.get('product_slug')
         variant_id = int(request.data.get('variant_id'))
         quantity = int(request.data.get('quantity', 1))
-        print(f"variant_id: {variant_id}, product_slug: {product_slug}")
-
-        # --- Step 1: Fetch variant by ID ---
-        variant_resp = requests.get(f"{PRODUCT_SERVICE_API}{variant_id}/")
-        if variant_resp.status_code != 200:
-            return Response({"error": "Variant service unavailable"}, status=503)
+        logger.debug("add to cart: variant_id=%s product_slug=%s", variant_id, product_slug)
 
+        # --- Step 1: Fetch variant by ID and product by slug (concurrently) ---
         try:
-            variant = variant_resp.json()
-        except ValueError:
-            return Response({"error": "Invalid response from variant service"}, status=502)
+            variant, product = fetch_variant_and_product(variant_id, product_slug)
+        except ProductServiceError as e:
+            return Response({"error": e.message}, status=e.status)
 
-        if not variant or 'id' not in variant:
-            return Response({"error": "Variant not found"}, status=404)
+        # --- Step 2: Create or update cart item ---
+        cart_item = add_item(cart, variant, product, product_slug, quantity)
 
-        # --- Step 2: Fetch product by slug to get product_id ---
-        product_resp = requests.get(f"https://products-k4ov.onrender.com/api/products/{product_slug}/")
-        if product_resp.status_code != 200:
-            return Response({"error": "Product service unavailable"}, status=503)
+        serializer = CartItemSerializer(cart_item)
+        return Response(serializer.data, status=201)
 
-        try:
-            product = product_resp.json()
-        except ValueError:
-            return Response({"error": "Invalid response from product service"}, status=502)
-
-        product_id = product.get("product_id")
-        if not product_id:
-            return Response({"error": "Product ID not found"}, status=404)
-
-        # --- Step 3: Create or update cart item ---
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            variant_id=variant['id'],
-            defaults={
-                'product_id': product_id,              # <-- now correct product_id
-                'product_name': product.get('product_name', product_slug),
-                'variant_name':variant_id,
-                'variant_name': variant.get('name', 'Unknown Variant'),
-                'sku': variant.get('sku', ''),
-                'price': variant.get('price', 0),
-                'quantity': quantity
-            }
-        )
 
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.price = variant.get('price', 0)
-            cart_item.save()
 
-        # Update cart total
-        cart.update_total()
 
-        serializer = CartItemSerializer(cart_item)
-        return Response(serializer.data, status=201)
 
 
+class BatchAddToCartView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [MicroserviceJWTAuthentication]
+
+    def post(self, request):
+        payload = BatchAddToCartSerializer(data=request.data)
+        payload.is_valid(raise_exception=True)
+
+        # Merge repeated variants so each one becomes a single upserted row
+        lines = {}
+        for line in payload.validated_data['items']:
+            if line['variant_id'] in lines:
+                lines[line['variant_id']]['quantity'] += line['quantity']
+            else:
+                lines[line['variant_id']] = dict(line)
+
+        # --- Step 1: Resolve every variant and product concurrently ---
+        try:
+            variants, products = fetch_catalog(
+                [line['variant_id'] for line in lines.values()],
+                [line['product_slug'] for line in lines.values()],
+            )
+        except ProductServiceError as e:
+            return Response({"error": e.message}, status=e.status)
+
+        # --- Step 2: Upsert every cart item in one statement ---
+        with transaction.atomic():
+            # get_or_create re-fetches if a concurrent request created the
+            # active cart first (unique_active_cart_per_user)
+            cart, _ = Cart.objects.select_for_update().get_or_create(user_id=request.user.id, is_active=True)
+
+            variant_ids = [variants[variant_id]['id'] for variant_id in lines]
+            existing = dict(
+                CartItem.objects.filter(cart=cart, variant_id__in=variant_ids).values_list('variant_id', 'quantity')
+            )
+
+            new_items = []
+            for variant_id, line in lines.items():
+                variant = variants[variant_id]
+                product = products[line['product_slug']]
+                new_items.append(CartItem(
+                    cart=cart,
+                    variant_id=variant['id'],
+                    product_id=product['product_id'],
+                    product_name=product.get('product_name', line['product_slug']),
+                    variant_name=variant.get('name', 'Unknown Variant'),
+                    sku=variant.get('sku', ''),
+                    price=variant.get('price', 0),
+                    quantity=existing.get(variant['id'], 0) + line['quantity'],
+                ))
+            CartItem.objects.bulk_create(
+                new_items,
+                update_conflicts=True,
+                unique_fields=['cart', 'variant_id'],
+                update_fields=['price', 'quantity', 'updated_at'],
+            )
 
+            # bulk_create skips the CartItem signals, so recompute once here
+            cart.update_total()
+            cart_cache.bump_version(cart.user_id)
 
+        items = CartItem.objects.filter(cart=cart, variant_id__in=variant_ids)
+        return Response({
+            "cart_id": cart.id,
+            "total_amount": cart.total_amount,
+            "items": CartItemSerializer(items, many=True).data,
+        }, status=201)
 
 
 class UpdateCartItemView(generics.UpdateAPIView):
@@ -110,12 +161,17 @@ class UpdateCartItemView(generics.UpdateAPIView):
 
     def get_queryset(self):
         cart, _ = Cart.objects.get_or_create(user_id=self.request.user.id, is_active=True)
-        return CartItem.objects.filter(cart=cart)
+        # cart is attached so the CartItem signals can bump the user's cart version
+        # Locked, so the subtotal the post_save delta starts from is current
+        return CartItem.objects.filter(cart=cart).select_related('cart').select_for_update()
+
+    @transaction.atomic
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
 
     def perform_update(self, serializer):
+        # cart total is adjusted by the CartItem post_save signal
         serializer.save()
-        # update cart total after quantity change
-        self.get_queryset().first().cart.update_total()
 
 
 
@@ -126,12 +182,16 @@ class DeleteCartItemView(generics.DestroyAPIView):
 
     def get_queryset(self):
         cart, _ = Cart.objects.get_or_create(user_id=self.request.user.id, is_active=True)
-        return CartItem.objects.filter(cart=cart)
+        # cart is attached so the CartItem signals can bump the user's cart version
+        return CartItem.objects.filter(cart=cart).select_related('cart').select_for_update()
+
+    @transaction.atomic
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
 
     def perform_destroy(self, instance):
-        cart = instance.cart
+        # cart total is adjusted by the CartItem post_delete signal
         instance.delete()
-        cart.update_total()
 
 
 
@@ -139,23 +199,39 @@ class DeleteCartItemView(generics.DestroyAPIView):
 class CheckoutView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [MicroserviceJWTAuthentication]
+    ORDER_NUMBER_ATTEMPTS = 3
 
     @transaction.atomic
     def post(self, request):
         user = request.user
-        cart = Cart.objects.get(user_id=user.id, is_active=True)
-        cart_items = cart.items.all()
-        if not cart_items.exists():
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key and len(idempotency_key) > 64:
+            return Response({"error": "Idempotency-Key is too long"}, status=400)
+
+        # Lock the active cart so concurrent checkouts of it serialize; the
+        # loser finds it already deactivated.
+        cart = Cart.objects.select_for_update().filter(user_id=user.id, is_active=True).first()
+
+        if idempotency_key:
+            existing = Order.objects.with_details().filter(user_id=user.id, idempotency_key=idempotency_key).first()
+            if existing:
+                return Response(OrderSerializer(existing).data, status=200)
+
+        if cart is None:
+            return Response({"error": "No active cart"}, status=400)
+
+        cart_items = list(cart.items.all())
+        if not cart_items:
             return Response({"error": "Cart is empty"}, status=400)
 
-        order = Order.objects.create(
+        order = self.create_order(
             user_id=user.id,
-            order_number=f"ORD-{uuid.uuid4().hex[:8].upper()}",
-            total_amount=cart.total_amount
+            total_amount=cart.total_amount,
+            idempotency_key=idempotency_key or None,
         )
 
-        for item in cart_items:
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
                 product_id=item.product_id,
                 variant_id=item.variant_id,
@@ -165,20 +241,36 @@ class CheckoutView(APIView):
                 price=item.price,
                 quantity=item.quantity
             )
+            for item in cart_items
+        ])
 
-        cart.is_active = False
-        cart.save()
+        Cart.objects.filter(pk=cart.pk).update(is_active=False, updated_at=timezone.now())
+        cart_cache.bump_version(user.id)
 
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=201)
 
+    def create_order(self, **fields):
+        # Order numbers from hosts whose shards clash can collide; the unique
+        # index catches it and the order is retried with a fresh number.
+        for attempt in range(self.ORDER_NUMBER_ATTEMPTS):
+            order_number = new_order_number()
+            try:
+                with transaction.atomic():
+                    return Order.objects.create(order_number=order_number, **fields)
+            except IntegrityError:
+                if attempt + 1 == self.ORDER_NUMBER_ATTEMPTS:
+                    raise
+                if not Order.objects.filter(order_number=order_number).exists():
+                    raise
+
 class GetOrderView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [MicroserviceJWTAuthentication]
 
     def get(self, request, order_id):
         try:
-            order = Order.objects.get(id=order_id, user_id=request.user.id)
+            order = Order.objects.with_details().get(id=order_id, user_id=request.user.id)
             serializer = OrderSerializer(order)
             return Response(serializer.data, status=200)
         except Order.DoesNotExist:
@@ -188,9 +280,10 @@ class AdminGetOrderView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = []
 
+    @replica_reads
     def get(self, request, order_id):
         try:
-            order = Order.objects.get(id=order_id)
+            order = Order.objects.with_details().get(id=order_id)
             serializer = OrderSerializer(order)
             return Response(serializer.data, status=200)
         except Order.DoesNotExist:
@@ -206,40 +299,25 @@ class PayOrderView(APIView):
         if order.status != "PENDING":
             return Response({"error": "Order already processed"}, status=400)
 
-        # Create Stripe Checkout Session
-        line_items = []
-        for item in order.items.all():
-            line_items.append({
-                'price_data': {
-                    'currency': 'inr', # or 'usd', default based on your locale
-                    'product_data': {
-                        'name': f"{item.product_name} - {item.variant_name}",
-                    },
-                    'unit_amount': int(item.price * 100), # Stripe expects amount in cents/paisa
-                },
-                'quantity': item.quantity,
-            })
+        # Repeated clicks get the still-open session back without calling Stripe
+        open_txn = order.transactions.filter(status='PENDING').order_by('-id').first()
+        if is_reusable(open_txn, order):
+            return Response({"checkout_url": open_txn.checkout_url}, status=200)
 
         domain = request.build_absolute_uri('/')[:-1] 
         success_url = request.data.get('success_url', domain + '/payment-success?session_id={CHECKOUT_SESSION_ID}')
         cancel_url = request.data.get('cancel_url', domain + '/payment-cancel')
+        params = checkout_params(order, order.items.all(), request.user.id, success_url, cancel_url)
 
         try:
-            checkout_session = stripe.checkout.Session.create(
-                line_items=line_items,
-                mode='payment',
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata={
-                    'order_id': str(order.id),
-                    'user_id': str(request.user.id),
-                }
+            checkout_session = get_gateway().create_checkout_session(
+                params, idempotency_key(order, open_txn, params)
             )
-            Transaction.objects.create(
-                order=order,
+            # Concurrent clicks share an idempotency key, hence a session; the
+            # unique stripe_session_id makes the losing create re-fetch
+            Transaction.objects.get_or_create(
                 stripe_session_id=checkout_session.id,
-                amount=order.total_amount,
-                status='PENDING'
+                defaults=transaction_defaults(order, checkout_session),
             )
 
             return Response({
@@ -260,7 +338,8 @@ class OrderPayStatusView(APIView):
             return Response({"error": "Order not found"}, status=404)
 
 import json
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
@@ -269,6 +348,12 @@ class StripeWebhookView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = []
 
+    HANDLED_EVENTS = (
+        'checkout.session.completed',
+        'checkout.session.expired',
+        'checkout.session.async_payment_failed',
+    )
+
     def post(self, request):
         payload = request.body
         sig_header = request.headers.get('STRIPE_SIGNATURE')
@@ -287,6 +372,28 @@ class StripeWebhookView(APIView):
         except Exception as e:
             return HttpResponse(status=400)
 
+        if event['type'] not in self.HANDLED_EVENTS:
+            return HttpResponse(status=200)
+
+        # Claiming the event and acting on it commit together: a retried or
+        # concurrent delivery of the same event stops at the ledger insert,
+        # and a failed attempt leaves no claim behind so Stripe's retry runs.
+        with transaction.atomic():
+            if not self.claim_event(event):
+                return HttpResponse(status=200)
+            self.handle_event(event)
+
+        return HttpResponse(status=200)
+
+    def claim_event(self, event):
+        try:
+            with transaction.atomic():
+                StripeEvent.objects.create(event_id=event['id'], type=event['type'])
+        except IntegrityError:
+            return False
+        return True
+
+    def handle_event(self, event):
         # Handle the checkout.session.completed event
         if event['type'] == 'checkout.session.completed':
             session = event['data']['object']
@@ -295,7 +402,7 @@ class StripeWebhookView(APIView):
             
             if order_id:
                 try:
-                    order = Order.objects.get(id=order_id)
+                    order = Order.objects.select_for_update().get(id=order_id)
                     if order.status == 'PENDING':
                         self.process_successful_payment(order, session_id)
                 except Order.DoesNotExist:
@@ -307,34 +414,35 @@ class StripeWebhookView(APIView):
             
             if order_id:
                 try:
-                    order = Order.objects.get(id=order_id)
+                    order = Order.objects.select_for_update().get(id=order_id)
                     if order.status == 'PENDING':
                         if event['type'] == 'checkout.session.async_payment_failed':
                             order.status = 'CANCELLED'
                         else:
                             order.status = 'CANCELLED'
-                        order.save(update_fields=['status'])
+                        order.save(update_fields=['status', 'updated_at'])
                         
                         try:
                             transaction_record = Transaction.objects.get(order=order, stripe_session_id=session_id)
                             transaction_record.status = 'FAILED'
-                            transaction_record.save(update_fields=['status'])
+                            transaction_record.save(update_fields=['status', 'updated_at'])
                         except Transaction.DoesNotExist:
                             pass
+                        # The user's next order reads must see this
+                        pin(order.user_id)
                 except Order.DoesNotExist:
                     pass
 
-        return HttpResponse(status=200)
-
     @transaction.atomic
     def process_successful_payment(self, order, session_id):
         order.status = "CONFIRMED"
-        order.save(update_fields=['status'])
+        order.save(update_fields=['status', 'updated_at'])
+        pin(order.user_id)
 
         try:
             transaction_record = Transaction.objects.get(order=order, stripe_session_id=session_id)
             transaction_record.status = 'SUCCESSFUL'
-            transaction_record.save(update_fields=['status'])
+            transaction_record.save(update_fields=['status', 'updated_at'])
         except Transaction.DoesNotExist:
             pass
 
@@ -343,29 +451,9 @@ class StripeWebhookView(APIView):
             status='PENDING'
         )
 
-        # Reduce stock via batch API (FIFO by exp_date)
-        for item in order.items.all():
-            qty_to_deduct = item.quantity
-            resp = requests.get(f"{BATCH_SERVICE_API}?variant={item.variant_id}&is_active=true")
-            if resp.status_code != 200:
-                raise Exception(f"Cannot fetch batches for variant {item.variant_id}")
-            batches = resp.json()
-            batches.sort(key=lambda x: x['exp_date'])
-
-            for batch in batches:
-                if qty_to_deduct <= 0:
-                    break
-                available_qty = batch['qty']
-                deduct_qty = min(qty_to_deduct, available_qty)
-                qty_to_deduct -= deduct_qty
-
-                # Update batch
-                update_resp = requests.patch(
-                    f"{BATCH_SERVICE_API}{batch['batch_id']}/",
-                    json={"qty": available_qty - deduct_qty}
-                )
-                if update_resp.status_code != 200:
-                    raise Exception(f"Failed to update batch {batch['batch_id']}")
+        # Stock is reduced via the batch API (FIFO by exp_date) by the
+        # process_stock_jobs worker, so the webhook returns right away.
+        StockDeductionJob.objects.create(order=order)
 
 
 class CancelOrderView(APIView):
@@ -392,21 +480,61 @@ class get_all_ordersView(APIView):
     permission_classes=[IsAuthenticated]
     authentication_classes=[MicroserviceJWTAuthentication]
 
+    @replica_reads
     def get(self,request):
-        orders=Order.objects.filter(user_id=request.user.id)
+        orders,next_cursor=paginate_orders(request,Order.objects.with_details().filter(user_id=request.user.id))
         serializer=OrderSerializer(orders,many=True)
 
-        return Response({"orders":serializer.data},status=status.HTTP_200_OK)
+        return Response({"orders":serializer.data,"next_cursor":next_cursor},status=status.HTTP_200_OK)
+
+def stream_orders_ndjson(after_id=0, using='default'):
+    # Walk the table in id order one chunk at a time so memory stays flat,
+    # and emit one JSON document per line. A client that loses the
+    # connection resumes with ?after_id=<last id it received>.
+    # The body is generated after the view returns, outside its replica
+    # routing, so the database is passed in explicitly.
+    chunk_size = settings.ORDERS_EXPORT_CHUNK_SIZE
+    while True:
+        chunk = list(Order.objects.using(using).with_details().filter(id__gt=after_id).order_by('id')[:chunk_size])
+        if not chunk:
+            return
+        for data in OrderSerializer(chunk, many=True).data:
+            yield json.dumps(data, cls=JSONEncoder) + "\n"
+        after_id = chunk[-1].id
 
 class admin_get_all_ordersView(APIView):
     permission_classes=[AllowAny]
     authentication_classes=[]
 
+    @replica_reads
     def get(self,request):
-        orders=Order.objects.all()
+        if request.query_params.get('export') == 'ndjson':
+            try:
+                after_id=int(request.query_params.get('after_id',0))
+            except ValueError:
+                return Response({"error":"after_id must be an integer"},status=status.HTTP_400_BAD_REQUEST)
+            return StreamingHttpResponse(
+                stream_orders_ndjson(after_id, using=Order.objects.db),content_type='application/x-ndjson'
+            )
+
+        orders,next_cursor=paginate_orders(request,Order.objects.with_details())
         serializer=OrderSerializer(orders,many=True)
 
-        return Response({"orders":serializer.data},status=status.HTTP_200_OK)
+        return Response({"orders":serializer.data,"next_cursor":next_cursor},status=status.HTTP_200_OK)
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        return Response({"caches": cache_stats()}, status=status.HTTP_200_OK)
+
+class UpstreamStatsView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        return Response({"upstreams": resilience.stats()}, status=status.HTTP_200_OK)
 
 class ActivenowView(APIView):
     permission_classes = [AllowAny]
@@ -421,16 +549,19 @@ class AdminUpdateOrderStatusView(APIView):
             order = Order.objects.get(id=order_id)
             new_status = request.data.get('status')
             if new_status in ['DISPATCHED', 'IN_TRANSIT', 'DELIVERED']:
-                delivery, created = Delivery.objects.get_or_create(order=order)
-                delivery.status = new_status
-                if new_status == 'DISPATCHED':
-                    delivery.dispatched_at = timezone.now()
-                    delivery.save(update_fields=['status', 'dispatched_at'])
-                elif new_status == 'DELIVERED':
-                    delivery.delivered_at = timezone.now()
-                    delivery.save(update_fields=['status', 'delivered_at'])
-                else:
-                    delivery.save(update_fields=['status'])
+                with transaction.atomic():
+                    delivery, created = Delivery.objects.get_or_create(order=order)
+                    delivery.status = new_status
+                    if new_status == 'DISPATCHED':
+                        delivery.dispatched_at = timezone.now()
+                        delivery.save(update_fields=['status', 'dispatched_at', 'updated_at'])
+                    elif new_status == 'DELIVERED':
+                        delivery.delivered_at = timezone.now()
+                        delivery.save(update_fields=['status', 'delivered_at', 'updated_at'])
+                    else:
+                        delivery.save(update_fields=['status', 'updated_at'])
+                    sync_verified_purchases(order)
+                pin(order.user_id)
                 return Response({'message': 'Status updated'}, status=200)
             return Response({'error': 'Invalid status'}, status=400)
         except Order.DoesNotExist:
@@ -439,10 +570,49 @@ class AdminUpdateOrderStatusView(APIView):
 class VerifyPurchaseView(APIView):
     permission_classes = [AllowAny]
 
+    @replica_reads
     def get(self, request, user_id, product_id):
-        has_purchased = OrderItem.objects.filter(
-            order__user_id=user_id,
-            order__delivery__status='DELIVERED',
-            product_id=product_id
-        ).exists()
-        return Response({'has_purchased': has_purchased})
+        return Response({'has_purchased': has_purchased(user_id, product_id)})
+
+class BatchVerifyPurchaseView(APIView):
+    permission_classes = [AllowAny]
+
+    @replica_reads
+    def post(self, request):
+        payload = BatchVerifyPurchaseSerializer(data=request.data)
+        payload.is_valid(raise_exception=True)
+        data = payload.validated_data
+        if 'user_ids' in data:
+            purchased = purchased_pairs((user_id, data['product_id']) for user_id in data['user_ids'])
+            return Response({
+                'product_id': data['product_id'],
+                'user_ids': [user_id for user_id in dict.fromkeys(data['user_ids'])
+                             if (user_id, data['product_id']) in purchased],
+            })
+        purchased = purchased_pairs((data['user_id'], product_id) for product_id in data['product_ids'])
+        return Response({
+            'user_id': data['user_id'],
+            'product_ids': [product_id for product_id in dict.fromkeys(data['product_ids'])
+                            if (data['user_id'], product_id) in purchased],
+        })
+
+class PurchaseFilterStatsView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        return Response(purchase_filter.stats())
+
+class BulkVerifyPurchaseView(APIView):
+    permission_classes = [AllowAny]
+
+    @replica_reads
+    def post(self, request):
+        payload = BulkVerifyPurchaseSerializer(data=request.data)
+        payload.is_valid(raise_exception=True)
+        pairs = [(pair['user_id'], pair['product_id']) for pair in payload.validated_data['pairs']]
+        purchased = purchased_pairs(pairs)
+        return Response({'results': [
+            {'user_id': user_id, 'product_id': product_id, 'has_purchased': (user_id, product_id) in purchased}
+            for user_id, product_id in pairs
+        ]})
@@ -7,10 +7,32 @@ For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
+from core import upstreams
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+_background = set()
+
+
+async def application(scope, receive, send):
+    # Django only speaks HTTP; answer the server's lifespan events here so
+    # each worker warms its upstream connections on its own event loop.
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            task = asyncio.create_task(upstreams.awarm_all())
+            _background.add(task)
+            task.add_done_callback(_background.discard)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,159 @@
+"""Read replica routing.
+
+Only code that opts in reads from the replica: views wrapped in
+``replica_reads`` and blocks inside ``use_replica()``. Everything else,
+writes included, stays on the primary. That keeps reads inside a write
+transaction consistent with it. An opted-in read still goes to the
+primary when:
+
+- no replica is configured (settings.REPLICA_DATABASE not in DATABASES);
+- the user wrote within the last REPLICA_PIN_SECONDS, so they always see
+  their own writes (read-your-writes). Pins are set by
+  core.middleware.ReplicaPinMiddleware after any successful unsafe
+  request, and by ``pin(user_id)`` for writes made on a user's behalf (the
+  Stripe webhook). They live in the cart cache backend, which settings
+  require to be redis when a replica is configured, so every worker sees
+  them;
+- the replica is more than REPLICA_MAX_LAG seconds behind, or unreachable.
+  Lag is measured at most every REPLICA_LAG_CHECK_INTERVAL seconds per
+  process.
+"""
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# The alias opted-in reads go to in the current request or task
+_read_alias = ContextVar("replica_read_alias", default=None)
+
+
+def replica_configured():
+    return settings.REPLICA_DATABASE in connections.settings
+
+
+def _pin_key(user_id):
+    return f"db:pin:{user_id}"
+
+
+def _pins():
+    # Shared with the cart cache; redis whenever a replica is configured
+    from carts.services import cart_cache
+
+    return cart_cache.get_backend()
+
+
+def pin(user_id):
+    """Send ``user_id``'s replica reads to the primary for REPLICA_PIN_SECONDS."""
+    if user_id is not None and replica_configured():
+        _pins().set(_pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return user_id is not None and _pins().get(_pin_key(user_id)) is not None
+
+
+def measure_lag(alias):
+    """Seconds ``alias`` is behind its primary; 0 where that can't be measured."""
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    with connection.cursor() as cursor:
+        # A standby that has replayed everything it received is current,
+        # however long ago the last transaction was.
+        cursor.execute(
+            "SELECT CASE WHEN NOT pg_is_in_recovery() "
+            "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+class _LagCache:
+    def __init__(self):
+        self.lag = 0.0
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self, alias):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return self.lag
+        # One caller measures; the others keep using the last value meanwhile
+        if not self._lock.acquire(blocking=False):
+            return self.lag
+        try:
+            try:
+                self.lag = measure_lag(alias)
+            except DatabaseError as e:
+                logger.warning("replica %s unavailable: %s", alias, e)
+                self.lag = math.inf
+            self.checked_at = now
+            return self.lag
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self.lag = 0.0
+        self.checked_at = None
+
+
+replica_lag = _LagCache()
+
+
+def read_alias(user_id=None):
+    """The database opted-in reads for ``user_id`` should go to right now."""
+    if not replica_configured() or is_pinned(user_id):
+        return DEFAULT_DB_ALIAS
+    if replica_lag.get(settings.REPLICA_DATABASE) > settings.REPLICA_MAX_LAG:
+        return DEFAULT_DB_ALIAS
+    return settings.REPLICA_DATABASE
+
+
+@contextmanager
+def use_replica(user_id=None):
+    """Route reads in this block to the replica when it's safe; yields the alias."""
+    alias = read_alias(user_id)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(method):
+    """Decorator for a read-only view method (``def get(self, request, ...)``,
+    or a ``post`` that only reads, like the batch lookups)."""
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        with use_replica(getattr(request.user, "id", None)):
+            return method(view, request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both, so objects loaded from either can be related
+        aliases = {DEFAULT_DB_ALIAS, settings.REPLICA_DATABASE}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica gets its schema from the primary
+        if db == settings.REPLICA_DATABASE:
+            return False
+        return None
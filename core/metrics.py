@@ -0,0 +1,235 @@
+"""In-process request metrics, exported as Server-Timing headers and in the
+Prometheus text format at /metrics/.
+
+core.middleware.TimingMiddleware opens a RequestStats for each request.
+A DB execute wrapper and ``track_upstream`` add to it, and the totals go
+into the histograms below when the response is ready. The registry is per
+process, so each gunicorn worker reports its own series; Prometheus sums
+them when it scrapes every worker, or you get one worker's view otherwise.
+"""
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for label_values, counts, total in sorted(series):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            lines += _histogram_lines(self.name, labels, self.buckets, counts, total)
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, value in series:
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+class RequestMetrics:
+    """Per-view request histograms, updated together under one lock so the
+    middleware pays for a single dict lookup and lock per request."""
+
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, method, status, elapsed, queries, db_time):
+        d = bisect_left(LATENCY_BUCKETS, elapsed)
+        q = bisect_left(COUNT_BUCKETS, queries)
+        t = bisect_left(LATENCY_BUCKETS, db_time)
+        with self._lock:
+            entry = self._views.get((view, method))
+            if entry is None:
+                entry = self._views[(view, method)] = [
+                    [0] * (len(LATENCY_BUCKETS) + 1), 0.0,
+                    [0] * (len(COUNT_BUCKETS) + 1), 0,
+                    [0] * (len(LATENCY_BUCKETS) + 1), 0.0,
+                    {},
+                ]
+            entry[0][d] += 1
+            entry[1] += elapsed
+            entry[2][q] += 1
+            entry[3] += queries
+            entry[4][t] += 1
+            entry[5] += db_time
+            entry[6][status] = entry[6].get(status, 0) + 1
+
+    def render(self):
+        with self._lock:
+            views = sorted(
+                (key, [list(entry[0]), entry[1], list(entry[2]), entry[3], list(entry[4]), entry[5], dict(entry[6])])
+                for key, entry in self._views.items()
+            )
+        lines = []
+        families = (
+            ("http_request_duration_seconds", "Time spent in Django per request.", 0, LATENCY_BUCKETS),
+            ("http_request_db_queries", "DB queries per request.", 2, COUNT_BUCKETS),
+            ("http_request_db_duration_seconds", "DB time per request.", 4, LATENCY_BUCKETS),
+        )
+        for name, help, index, buckets in families:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+            for (view, method), entry in views:
+                lines += _histogram_lines(
+                    name, f'view="{view}",method="{method}"', buckets, entry[index], entry[index + 1]
+                )
+        lines += ["# HELP http_responses_total Responses by view and status code.", "# TYPE http_responses_total counter"]
+        for (view, method), entry in views:
+            for status, count in sorted(entry[6].items()):
+                lines.append(f'http_responses_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+        return lines
+
+
+def _histogram_lines(name, labels, buckets, counts, total):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets + ("+Inf",), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {total}")
+    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+    return lines
+
+
+request_metrics = RequestMetrics()
+request_upstream_duration = Histogram(
+    "http_request_upstream_duration_seconds",
+    "Time per request spent on outbound HTTP calls to each target.",
+    ("view", "target"),
+)
+request_upstream_calls = Counter(
+    "http_request_upstream_calls_total", "Outbound HTTP calls made by each view.", ("view", "target")
+)
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds",
+    "Every outbound HTTP call by target, in requests, workers and commands alike.",
+    ("target",),
+)
+
+REGISTRY = [request_metrics, request_upstream_duration, request_upstream_calls, upstream_duration]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    __slots__ = ("db_queries", "db_time", "upstream")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        # (target, seconds); list.append is safe from pool threads
+        self.upstream = []
+
+
+# The RequestStats of the request being served, set by TimingMiddleware
+current = ContextVar("request_stats", default=None)
+
+
+class track_upstream:
+    """Time one outbound call: ``with track_upstream("products"): ...``"""
+
+    __slots__ = ("target", "start")
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = perf_counter() - self.start
+        upstream_duration.observe((self.target,), elapsed)
+        stats = current.get()
+        if stats is not None:
+            stats.upstream.append((self.target, elapsed))
+        return False
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += perf_counter() - start
+        stats.db_queries += 1
+
+
+def install_db_wrapper(connection, **kwargs):
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+def install_db_wrappers():
+    # New connections get the wrapper via connection_created; this covers
+    # ones opened before the middleware was loaded.
+    connection_created.connect(install_db_wrapper)
+    for connection in connections.all(initialized_only=True):
+        install_db_wrapper(connection)
+
+
+def record(stats, view, method, status, elapsed):
+    """Fold a finished request into the histograms and return its Server-Timing value."""
+    request_metrics.observe(view, method, status, elapsed, stats.db_queries, stats.db_time)
+    timing = 'app;dur=%.1f, db;dur=%.1f;desc="%d queries"' % (elapsed * 1e3, stats.db_time * 1e3, stats.db_queries)
+    if stats.upstream:
+        per_target = {}
+        for target, seconds in stats.upstream:
+            calls, total = per_target.get(target, (0, 0.0))
+            per_target[target] = (calls + 1, total + seconds)
+        for target, (calls, total) in per_target.items():
+            request_upstream_duration.observe((view, target), total)
+            request_upstream_calls.inc((view, target), calls)
+            timing += f', {target};dur={total * 1e3:.1f};desc="{calls} calls"'
+    return timing
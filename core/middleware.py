@@ -0,0 +1,94 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from . import db_router, metrics
+from .metrics import RequestStats, current
+
+
+class TimingMiddleware:
+    """Times each request and its DB and upstream calls (see core.metrics).
+
+    Sits first in MIDDLEWARE so the timing covers the other middleware too.
+    For streaming responses only the time to the first byte is counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        metrics.install_db_wrappers()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current.set(stats)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, stats, perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, stats, perf_counter() - start)
+
+    def finish(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unmatched"
+        response["Server-Timing"] = metrics.record(stats, view, request.method, response.status_code, elapsed)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """Pins the user to the primary after a successful unsafe request.
+
+    DRF authenticates inside the view and sets the user on the underlying
+    request, so it is available here on the way out.
+    """
+
+    sync_capable = True
+    async_capable = True
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        user_id = self.user_to_pin(request, response)
+        if user_id is not None:
+            db_router.pin(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = self.user_to_pin(request, response)
+        if user_id is not None:
+            await sync_to_async(db_router.pin)(user_id)
+        return response
+
+    def user_to_pin(self, request, response):
+        if request.method in self.SAFE_METHODS or response.status_code >= 400 or not db_router.replica_configured():
+            return None
+        user = getattr(request, "user", None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.id
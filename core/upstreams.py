@@ -0,0 +1,165 @@
+"""Registry of the HTTP services this app calls.
+
+Each entry in settings.UPSTREAM_SERVICES owns its base URL, pool size,
+timeouts, retry and keep-alive policy. ``get(name)`` returns the Service
+with its pooled requests session and per-event-loop httpx client. Every
+caller of an upstream goes through here instead of building URLs and
+sessions itself.
+
+``warm_all()`` / ``awarm_all()`` open connections ahead of traffic (DNS,
+TCP and TLS, and it wakes a sleeping Render service). They run at worker
+boot from gunicorn.conf.py and from the ASGI lifespan startup in
+core/asgi.py.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class Service:
+    def __init__(
+        self,
+        name,
+        base_url,
+        pool_size=10,
+        async_pool_size=None,
+        connect_timeout=3.05,
+        read_timeout=10,
+        max_retries=0,
+        backoff_factor=0,
+        backoff_jitter=0,
+        keepalive_expiry=60,
+        warm_connections=1,
+        warm_async=False,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.async_pool_size = async_pool_size or pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        # Idle seconds before the async client drops a connection; 0 turns
+        # keep-alive off for both clients.
+        self.keepalive_expiry = keepalive_expiry
+        self.warm_connections = warm_connections
+        # Only worth it for services called from the async views
+        self.warm_async = warm_async
+        # (connect, read) timeouts in seconds, for every sync call
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self._build_session()
+        # httpx pools are bound to an event loop, so keep one client per loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def url(self, path=""):
+        return f"{self.base_url}{path}"
+
+    @property
+    def origin(self):
+        parts = urlsplit(self.base_url)
+        return f"{parts.scheme}://{parts.netloc}/"
+
+    def _build_session(self):
+        # Retries are for idempotent GETs only, with exponential backoff plus
+        # jitter on connection errors and 502/503/504.
+        retry = Retry(
+            total=self.max_retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET"}),
+            backoff_factor=self.backoff_factor,
+            backoff_jitter=self.backoff_jitter,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.keepalive_expiry:
+            session.headers["Connection"] = "close"
+        return session
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.async_pool_size,
+                    max_keepalive_connections=self.async_pool_size if self.keepalive_expiry else 0,
+                    keepalive_expiry=self.keepalive_expiry or None,
+                ),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def warm(self):
+        """Open up to ``warm_connections`` pooled connections concurrently."""
+        def connect():
+            try:
+                self.session.head(self.origin, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("warming %s failed: %s", self.name, e)
+
+        threads = [threading.Thread(target=connect) for _ in range(min(self.warm_connections, self.pool_size))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    async def awarm(self):
+        client = self.async_client()
+
+        async def connect():
+            try:
+                await client.head(self.origin)
+            except httpx.HTTPError as e:
+                logger.warning("warming %s (async) failed: %s", self.name, e)
+
+        await asyncio.gather(*(connect() for _ in range(min(self.warm_connections, self.async_pool_size))))
+
+
+_services = {}
+_lock = threading.Lock()
+
+
+def get(name):
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = _services[name] = Service(name, **settings.UPSTREAM_SERVICES[name])
+    return service
+
+
+def warm_all():
+    threads = [threading.Thread(target=get(name).warm) for name in settings.UPSTREAM_SERVICES]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def warm_all_in_background():
+    # Warming can take as long as a cold start upstream; never hold up boot
+    threading.Thread(target=warm_all, name="upstream-warm-up", daemon=True).start()
+
+
+async def awarm_all():
+    services = [get(name) for name in settings.UPSTREAM_SERVICES]
+    await asyncio.gather(*(service.awarm() for service in services if service.warm_async))
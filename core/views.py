@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, protected by the METRICS_TOKEN bearer token."""
+    token = settings.METRICS_TOKEN
+    if not token or request.headers.get("Authorization", "") != f"Bearer {token}":
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,15 @@
+# Loaded automatically by gunicorn from the working directory; the worker
+# class and app are still given in the procfile.
+
+
+def post_worker_init(worker):
+    # Open pooled connections to every upstream (DNS, TCP, TLS) in the
+    # background, so the first requests after a deploy or a Render cold
+    # start don't pay for the handshakes. Async clients are warmed by the
+    # ASGI lifespan startup in core/asgi.py.
+    from carts.services.purchases import purchase_filter
+    from core import upstreams
+
+    upstreams.warm_all_in_background()
+    # Built on a background thread; verify calls use the database until then
+    purchase_filter.warm()